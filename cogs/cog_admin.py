@@ -4,6 +4,7 @@ import pymysql as sql
 import discord
 from discord import option
 from discord.ext import commands
+from discord.ext.pages import Paginator
 import utils
 
 
@@ -100,6 +101,49 @@ class AdminCog(commands.Cog):
         utils.db_connector().commit()
         await ctx.respond(f"✔ `Channel {channel.name} has been removed as a forum channel`", ephemeral=True)
 
+    @admin.command(name="jobs", description="Show stuck and dead jobs from the web interface")
+    @option(name="retry", description="The ID of a dead job to queue again", required=False)
+    async def jobs(self, ctx: discord.ApplicationContext, retry: int = None):
+        if not await utils.has_permission(ctx, "manage_local_permissions"):
+            await ctx.respond("❌ `You do not have permission to manage jobs`", ephemeral=True)
+            return
+        jobs_table = os.getenv('JOBS_TABLE')
+        if retry is not None:
+            utils.db_connector().execute(f"UPDATE {jobs_table} SET status = %s, attempts = 0, next_attempt_at = NULL "
+                                         f"WHERE id = %s AND status = %s", ("pending", retry, "dead"))
+            utils.db_connector().commit()
+            if utils.db_connector().cursor.rowcount == 0:
+                await ctx.respond(f"❌ `Job {retry} is not dead`", ephemeral=True)
+                return
+            await ctx.respond(f"✔ `Job {retry} has been queued again`", ephemeral=True)
+            return
+        utils.db_connector().execute(f"SELECT status, COUNT(*) FROM {jobs_table} WHERE process_id = %s "
+                                     f"GROUP BY status", (utils.get_config("JOB_BOT_NAME"),))
+        counts = ", ".join([f"{status}: {count}" for status, count in utils.db_connector().fetchall()])
+        # Stuck jobs are running on an expired lease, or waiting to be retried
+        utils.db_connector().execute(f"SELECT id, status, attempts, next_attempt_at, last_error FROM {jobs_table} "
+                                     f"WHERE process_id = %s AND (status = %s OR (status = %s AND attempts > 0) OR "
+                                     f"(status = %s AND lease_expires < NOW())) ORDER BY id DESC LIMIT 100",
+                                     (utils.get_config("JOB_BOT_NAME"), "dead", "pending", "running"))
+        items = []
+        for job_id, status, attempts, next_attempt_at, last_error in utils.db_connector().fetchall():
+            if status == "pending":
+                status = f"retrying {utils.to_discord_timestamp(next_attempt_at.timestamp(), 'R')}" \
+                    if next_attempt_at else "retrying"
+            elif status == "running":
+                status = "stuck, lease expired"
+            items.append({"name": f"Job {job_id} ({attempts} attempt(s))",
+                          "value": f"**{status}**\n`{utils.limit(last_error or 'No error recorded', 200)}`"})
+        if not items:
+            await ctx.respond(f"✔ `No stuck or dead jobs` ({counts or 'no jobs'})", ephemeral=True)
+            return
+        embed_data = {
+            "title": "Stuck and dead jobs",
+            "description": f"{counts}\nUse `/admin jobs retry:<id>` to queue a dead job again."
+        }
+        pages = utils.paginator(items=items, embed_data=embed_data, per_page=10)
+        await Paginator(pages=pages, loop_pages=True).respond(ctx.interaction, ephemeral=True)
+
     @commands.Cog.listener()
     async def on_ready(self):
         self.logger.info(f'Hello from {self.__class__.__name__}!')
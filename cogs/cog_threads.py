@@ -1,10 +1,10 @@
 import asyncio
-import datetime
+import heapq
 import json
 import logging
 import os
 import re
-from copy import copy
+import time
 import discord
 from discord import option
 from discord.ext import commands, tasks
@@ -44,9 +44,7 @@ class NoteModal(discord.ui.Modal):
             (new_note, util.time_since_epoch(), interaction.channel.id))
         utils.db_connector().commit()
         # update the note
-        note = await util.get_note(interaction.channel)
-        m = await interaction.channel.fetch_message(note[2])
-        await m.edit(content=None, embed=await util.build_forum_embed(interaction.channel))
+        await interaction.client.get_cog("ThreadsCog").refresh_note(interaction.channel)
         await interaction.followup.send("✔ `Note updated!`", ephemeral=True, delete_after=5)
         return True
 
@@ -91,16 +89,29 @@ class DefaultNoteModal(NoteModal):
 
 
 class EditNoteButtonView(discord.ui.View):
-    def __init__(self, permitted_users, bot=None, logger=None):
-        super().__init__()
+    """
+    The buttons under every note. The cog registers one instance with bot.add_view, which answers the clicks on all
+    notes, including the ones posted before a restart. The notes themselves are sent with store=False copies that
+    only carry the buttons.
+    """
+
+    def __init__(self, bot=None, logger=None, store=True):
+        """
+        Initialize the EditNoteButtonView.
+
+        Args:
+            bot (commands.Bot): The bot instance.
+            logger (logging.Logger): The logger instance.
+            store (bool): Whether this instance answers the clicks, False for the copies sent with the notes.
+        """
+        super().__init__(timeout=None, store=store)
         self.bot = bot
         self.logger = logger
-        self.permitted_users = permitted_users
 
     @discord.ui.button(label="Edit Note", style=discord.ButtonStyle.primary, custom_id="button_edit_note")
     async def button_edit_note(self, button: discord.ui.Button, interaction: discord.Interaction):
-        self.permitted_users = await util.get_all_allowed_users(interaction.channel)
-        if interaction.user.id not in self.permitted_users:
+        # Checked when clicked, so the note doesn't have to be edited when the permissions change
+        if interaction.user.id not in await util.get_all_allowed_users(interaction.channel):
             await interaction.respond("❌ `You do not have permission to edit this note!`", ephemeral=True)
             return
         note = await util.get_note(interaction.channel, replace_tags=False)
@@ -110,64 +121,99 @@ class EditNoteButtonView(discord.ui.View):
 
     @discord.ui.button(label="Assign User", style=discord.ButtonStyle.primary, custom_id="button_assign_user")
     async def button_assign_user(self, button: discord.ui.Button, interaction: discord.Interaction):
-        self.permitted_users = await util.get_all_allowed_users(interaction.channel)
-        if interaction.user.id not in self.permitted_users:
+        if interaction.user.id not in await util.get_all_allowed_users(interaction.channel):
             await interaction.respond("❌ `You do not have permission to assign users to this thread!`", ephemeral=True)
             return
-        guild_members = copy(interaction.guild.members)
-        # remove bots, the thread owner and admins from the list, if there are more than 25 members
-        if len(guild_members) > 25 or utils.is_debug():
-            guild_members = [member for member in guild_members if not member.bot and
-                             member.id != interaction.channel.owner_id and
-                             not any([role.permissions.administrator for role in member.roles])]
-            if len(guild_members) == 0:
-                guild_members = copy(interaction.guild.members)
-            await interaction.respond("Assign a user to this thread\n-# **Some users have been removed to fit in the "
-                                      "limit of discord's dropdown menu. If you can't find a user, use the manual "
-                                      "assign button to assign them manually.**", view=UserSelectAssignView(
-                                        guild_members, interaction.followup,
-                                        await utils.get_thread_assigned_users(interaction.channel), self.bot,
-                                        self.logger), ephemeral=True)
-            return True
-        await interaction.respond("Assign a user to this thread", view=UserSelectAssignView(
-            guild_members, interaction.followup,
-            await utils.get_thread_assigned_users(interaction.channel), self.bot, self.logger), ephemeral=True)
+        assigned = await utils.get_thread_assigned_users(interaction.channel)
+        await interaction.respond("Assign a user to this thread\n-# Pick users from the list or search them by name. "
+                                  "Picking a user who is already assigned unassigns them.",
+                                  view=UserSelectAssignView(assigned, self.bot, self.logger), ephemeral=True)
+        return True
+
+
+class MemberSearchModal(discord.ui.Modal):
+    """
+    A modal dialog for finding members to assign by the start of their name.
+
+    Attributes:
+        assign_view (UserSelectAssignView): The view the search was started from.
+    """
+
+    def __init__(self, assign_view, *args, **kwargs) -> None:
+        """
+        Initialize the MemberSearchModal.
+
+        Args:
+            assign_view (UserSelectAssignView): The view the search was started from.
+        """
+        super().__init__(*args, **kwargs)
+        self.assign_view = assign_view
+        self.add_item(discord.ui.InputText(label="Name", placeholder="The start of a username or display name",
+                                           max_length=32))
+
+    async def callback(self, interaction: discord.Interaction):
+        """
+        Handle the submission of the modal.
+
+        Args:
+            interaction (discord.Interaction): The interaction that triggered the modal.
+        """
+        query = interaction.data["components"][0]["components"][0]["value"]
+        index = interaction.client.get_cog("ThreadsCog").get_member_index(interaction.guild)
+        members = [interaction.guild.get_member(member_id) for member_id in index.search(query)]
+        members = [member for member in members if member is not None]
+        if not members:
+            await interaction.response.send_message(f"❌ `No members found for \"{query}\"`", ephemeral=True,
+                                                    delete_after=5)
+            return False
+        await interaction.response.edit_message(
+            content=f"Assign a user to this thread\n-# {len(members)} member(s) found for \"{query}\"",
+            view=UserSelectAssignView(self.assign_view.assigned, self.assign_view.bot, self.assign_view.logger,
+                                      members))
         return True
 
 
 class UserSelectAssignView(discord.ui.View):
-    def __init__(self, users, followup, assigned, bot=None, logger=None):
+    def __init__(self, assigned, bot=None, logger=None, matches=None):
         super().__init__()
         self.bot = bot
         self.logger = logger
-        self.users = users
-        self.followup = followup
-        print(len(self.build_assign_choices()))
-        select = discord.ui.Select(placeholder="Select a user to assign", options=self.build_assign_choices(assigned),
-                                   min_values=1)
-
+        self.assigned = assigned
+        # Discord searches the guild's members itself, so nothing needs to be listed here
+        select = discord.ui.Select(discord.ComponentType.user_select, placeholder="Select users to assign",
+                                   min_values=1, max_values=25)
         select.callback = self.select_assign_user
-        if len(users) > 25 or utils.is_debug():
-            self.logger.warning(f"Too many users to build ({len(users)})! Capping to 25 and adding a other button")
-            self.users = self.users[:25]
-            button = discord.ui.Button(label="Manual Assign", style=discord.ButtonStyle.secondary,
-                                       custom_id="button_other_assign_user")
-            button.callback = self.button_other_assign_user
-            self.add_item(button)
         self.add_item(select)
-
-    def build_assign_choices(self, assigned=None):
-        if assigned is None:
-            assigned = []
+        button = discord.ui.Button(label="Search by Name", style=discord.ButtonStyle.secondary)
+        button.callback = self.button_search_assign_user
+        self.add_item(button)
+        button = discord.ui.Button(label="Manual Assign", style=discord.ButtonStyle.secondary,
+                                   custom_id="button_other_assign_user")
+        button.callback = self.button_other_assign_user
+        self.add_item(button)
+        if matches:
+            # The results of a name search
+            select = discord.ui.Select(placeholder="Select from the search results",
+                                       options=self.build_assign_choices(matches), min_values=1,
+                                       max_values=len(matches))
+            select.callback = self.select_assign_user
+            self.add_item(select)
+
+    def build_assign_choices(self, members):
         choices = []
-        for user in self.users:
+        for user in members:
             # if user.id not already assigned
-            if user.id not in assigned:
-                choices.append(discord.SelectOption(label=user.name, value=str(user.id)))
+            if user.id not in self.assigned:
+                choices.append(discord.SelectOption(label=user.name, value=str(user.id),
+                                                    description=util.limit(user.display_name, 100)))
             else:
-                choices.append(discord.SelectOption(label=f"(Already Assigned) {user.name}", value=str(user.id)))
+                choices.append(discord.SelectOption(label=f"(Already Assigned) {user.name}", value=str(user.id),
+                                                    description=util.limit(user.display_name, 100)))
         return choices
 
+    async def button_search_assign_user(self, interaction: discord.Interaction):
+        await interaction.response.send_modal(MemberSearchModal(self, title="Search members to assign"))
+
     async def button_other_assign_user(self, interaction: discord.Interaction):
         # edit the message to show the user that they can mention users to assign them
         await interaction.response.edit_message(content="`Mention a user to assign them to this thread.`\n-# If they "
@@ -209,10 +255,7 @@ class UserSelectAssignView(discord.ui.View):
         await interaction.followup.send(content=f"✔ ` {len(assigned)} User(s) assigned and {unassigned} unassigned!`",
                                         delete_after=5)
         # update the note
-        note = await util.get_note(interaction.channel)
-        m = await interaction.channel.fetch_message(note[2])
-        await m.edit(content=None, embed=await util.build_forum_embed(interaction.channel), view=EditNoteButtonView(
-            await util.get_all_allowed_users(interaction.channel), self.bot, self.logger))
+        await interaction.client.get_cog("ThreadsCog").refresh_note(interaction.channel)
         return True
 
     async def select_assign_user(self, interaction: discord.Interaction):
@@ -224,6 +267,15 @@ class UserSelectAssignView(discord.ui.View):
         assigned = await utils.get_thread_assigned_users(interaction.channel)
         for selected_user in selected_users:
             user = interaction.guild.get_member(int(selected_user))
+            if user is None:
+                # The user select can return members that aren't cached
+                try:
+                    user = await interaction.guild.fetch_member(int(selected_user))
+                except discord.NotFound:
+                    # They left the guild after being picked
+                    continue
+            if user.bot:
+                continue
             if user.id in assigned:
                 assigned.remove(user.id)
                 # dm the user that they have been removed
@@ -248,19 +300,48 @@ class UserSelectAssignView(discord.ui.View):
         elif len(selected_users) == 1:
             await interaction.followup.send(
                 f"✔ `{'Assigned' if added else 'Unassigned'} "
-                f"{interaction.guild.get_member(int(selected_users[0])).name} {'to' if added else 'from'} the thread`",
+                f"{user.name} {'to' if added else 'from'} the thread`",
                 ephemeral=True)
         else:
             await interaction.followup.send(
                 f"✔ `Assigned {added} user(s) and unassigned {removed} user(s) from the thread`",
                 ephemeral=True)
-        note = await util.get_note(interaction.channel)
-        m = await interaction.channel.fetch_message(note[2])
-        await m.edit(content=None, embed=await util.build_forum_embed(interaction.channel), view=EditNoteButtonView(
-            await util.get_all_allowed_users(interaction.channel), self.bot, self.logger))
+        await interaction.client.get_cog("ThreadsCog").refresh_note(interaction.channel)
         return True
 
 
+class RefreshRun:
+    """
+    The progress of a note refresh running in the background.
+
+    Attributes:
+        id (int): The handle shown to the user.
+        total (int): The number of threads to refresh.
+    """
+
+    def __init__(self, run_id, total):
+        self.id = run_id
+        self.total = total
+        self.done = 0
+        self.edited = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.task = None
+
+    def summary(self):
+        """
+        Describe the progress of the run.
+
+        Returns:
+            str: A one line summary.
+        """
+        elapsed = (self.finished or time.monotonic()) - self.started
+        state = "finished" if self.finished else "running"
+        return (f"Refresh #{self.id} {state}: {self.done}/{self.total} threads checked, {self.edited} edited, "
+                f"{self.failed} failed ({elapsed:.0f}s)")
+
+
 async def build_thread_choices(ctx: discord.AutocompleteContext):
     """
     Build the choices for the thread autocomplete. The autocomplete will show forum channel in the current guild.
@@ -300,56 +381,337 @@ class ThreadsCog(commands.Cog):
         self.logger.handlers = logger.handlers
         self.logger.setLevel(logger.level)
         self.logger.propagate = False
-        self.WARNING_COOLDOWN_MESSAGE = None
+        # One view answers the note buttons of every thread, registered in on_ready since views need a running loop
+        self.note_view_registered = False
+        # Threads whose note needs rendering again, refreshed by update_notes
+        self.dirty_threads = set()
+        self.dirty_seeded = False
+        # Note edits run NOTE_REFRESH_CONCURRENCY at a time, paced to NOTE_REFRESH_RATE per second overall and one
+        # per second per thread (each thread is its own rate limit bucket)
+        self.refresh_pool = utils.JobPool(int(os.getenv("NOTE_REFRESH_CONCURRENCY", "4")))
+        self.refresh_pacer = utils.Pacer(float(os.getenv("NOTE_REFRESH_RATE", "20")), key_interval=1)
+        self.refresh_runs = {}
+        self.next_refresh_run = 1
+        # Refreshes of the same note within NOTE_EDIT_WINDOW seconds are merged into one edit
+        self.note_edit_window = float(os.getenv("NOTE_EDIT_WINDOW", "1.5"))
+        self.pending_edits = {}
+        self.last_edit_at = {}
+        self.edit_stats = {"edits": 0, "saved": 0}
+        # Milliseconds between a thread being created and its note being posted, for the last 100 threads
+        self.note_post_latency = []
+        # Message counts and note message IDs of tracked threads, so on_message needs no REST calls
+        self.thread_message_counts = {}
+        self.note_ids = {}
+        # When each thread's note is due to be posted again (epoch seconds), mirrored in note_repost_at
+        self.repost_deadlines = {}
+        self.repost_interval = int(os.getenv("NOTE_REPOST_HOURS", "24")) * 3600
+        # Sticky channels repost the note below new activity once a thread has been quiet for STICKY_DEBOUNCE seconds
+        self.sticky_channels = {}
+        self.sticky_debounce = float(os.getenv("STICKY_DEBOUNCE", "30"))
+        self.sticky_heap = []
+        self.sticky_due = {}
+        self.sticky_wakeup = asyncio.Event()
+        # Renames held back by the rename cooldown: thread_id -> (due, name, warning message ID), due times in a heap
+        self.pending_renames = {}
+        self.rename_heap = []
+        self.rename_wakeup = asyncio.Event()
+        # Prefix search indexes of member names for the assign picker, built per guild the first time it is searched
+        self.member_indexes = {}
 
     forum = discord.SlashCommandGroup(name="forum", description="Commands for managing forum posts")
     assign = forum.create_subgroup(name="assign", description="Commands for assigning users to forum posts.")
 
     @tasks.loop(minutes=5)
-    async def update_notes(self, channel=None):
+    async def update_notes(self, channel=None, force=False):
         """
-        Periodically update the notes for all threads.
+        Periodically refresh the notes of threads marked dirty.
+
+        Args:
+            channel (discord.ForumChannel): Refresh every thread in this channel instead of only the dirty ones.
+            force (bool): Edit the notes even if their rendered content hasn't changed.
         """
         await self.bot.wait_until_ready()
-        if channel:
+        if channel or force:
+            threads = self.select_threads(channel)
+        else:
+            if not self.dirty_seeded:
+                # Notes rendered before render hashes were stored need one more refresh to record theirs
+                utils.db_connector().execute(
+                    f"SELECT thread_id FROM {utils.table('threads')} WHERE note_render_hash IS NULL")
+                self.dirty_threads.update(row[0] for row in utils.db_connector().fetchall())
+                self.dirty_seeded = True
+            if not self.dirty_threads:
+                return
+            dirty = list(self.dirty_threads)
+            self.dirty_threads.clear()
             utils.db_connector().execute(
-                f"SELECT thread_id, note_id FROM {utils.table('threads')} WHERE channel_id = %s", (channel.id,))
+                f"SELECT thread_id, note_id, note_render_hash FROM {utils.table('threads')} "
+                f"WHERE thread_id IN ({', '.join(['%s'] * len(dirty))})", dirty)
             threads = utils.db_connector().fetchall()
+        run = await self.refresh_threads(threads, force)
+        self.logger.info(f"{run.summary()} (note edits so far: {self.edit_stats['edits']} made, "
+                         f"{self.edit_stats['saved']} saved by merging)")
+
+    def select_threads(self, channel=None, channel_ids=None):
+        """
+        Get the thread rows to refresh.
+
+        Args:
+            channel (discord.ForumChannel): Only threads in this channel, or every tracked thread if None.
+            channel_ids (list): Only threads in these channels (e.g. a guild's forum channels), used without a channel.
+
+        Returns:
+            list: (thread_id, note_id, note_render_hash) rows.
+        """
+        if channel:
+            utils.db_connector().execute(
+                f"SELECT thread_id, note_id, note_render_hash FROM {utils.table('threads')} WHERE channel_id = %s",
+                (channel.id,))
+        elif channel_ids is not None:
+            if not channel_ids:
+                return []
+            utils.db_connector().execute(
+                f"SELECT thread_id, note_id, note_render_hash FROM {utils.table('threads')} "
+                f"WHERE channel_id IN ({', '.join(['%s'] * len(channel_ids))})", list(channel_ids))
         else:
-            utils.db_connector().execute(f"SELECT thread_id, note_id FROM {utils.table('threads')}")
-            threads = utils.db_connector().fetchall()
-        for thread in threads:
-            t = self.bot.get_channel(thread[0])
+            utils.db_connector().execute(
+                f"SELECT thread_id, note_id, note_render_hash FROM {utils.table('threads')}")
+        return utils.db_connector().fetchall()
+
+    async def refresh_threads(self, threads, force=False, run=None):
+        """
+        Refresh many notes concurrently through the refresh pool.
+
+        Args:
+            threads (list): (thread_id, note_id, note_render_hash) rows.
+            force (bool): Edit the notes even if their rendered content hasn't changed.
+            run (RefreshRun): The run to report progress to, a new one is made if None.
+
+        Returns:
+            RefreshRun: The finished run.
+        """
+        if run is None:
+            run = RefreshRun(0, len(threads))
+
+        async def refresh(row):
+            t = self.bot.get_channel(row[0])
             if not t:
-                self.logger.warning(f"Thread {thread[0]} not found, deleting from database.")
-                utils.db_connector().execute(f"DELETE FROM {utils.table('threads')} WHERE thread_id = %s", (thread[0],))
+                self.logger.warning(f"Thread {row[0]} not found, deleting from database.")
+                utils.db_connector().execute(f"DELETE FROM {utils.table('threads')} WHERE thread_id = %s", (row[0],))
                 utils.db_connector().commit()
-                continue
             else:
-                try:
-                    m = await t.fetch_message(thread[1])
-                except discord.errors.NotFound:
-                    self.logger.warning(f"Note message {thread[1]} not found, deleting from database.")
-                    utils.db_connector().execute(f"DELETE FROM {utils.table('threads')} WHERE thread_id = %s",
-                                                 (thread[0],))
-                    utils.db_connector().commit()
-                    continue
-                embed = await util.build_forum_embed(t)
-                try:
-                    if embed.description == m.embeds[0].description:
-                        self.logger.info(f"Note for {t.name} is up to date, refreshing the buttons.")
-                        await m.edit(view=EditNoteButtonView(
-                            await util.get_all_allowed_users(t), self.bot, self.logger))
-                        continue
-                except IndexError:
-                    pass
-                self.logger.info(f"Note {t.name} is out of date, updating.")
-                await m.edit(embed=embed, content=None, view=EditNoteButtonView(
-                    await util.get_all_allowed_users(t), self.bot, self.logger))
+                async with self.refresh_pool.slot(t.id):
+                    try:
+                        if await self.refresh_note(t, row[1], row[2], force):
+                            run.edited += 1
+                    except discord.HTTPException as e:
+                        stats = {}
+                        utils.note_rate_limit(e, stats)
+                        if "retry_after" in stats:
+                            self.refresh_pool.pause(stats["retry_after"])
+                        self.logger.error(f"Failed to refresh the note of {t.name}: {e}")
+                        run.failed += 1
+            run.done += 1
+
+        await asyncio.gather(*[refresh(row) for row in threads])
+        run.finished = time.monotonic()
+        return run
+
+    def start_refresh(self, threads, force=False, on_progress=None):
+        """
+        Start refreshing notes in the background.
+
+        Args:
+            threads (list): (thread_id, note_id, note_render_hash) rows.
+            force (bool): Edit the notes even if their rendered content hasn't changed.
+            on_progress: Optional coroutine function called with the run every few seconds and once it is done.
+
+        Returns:
+            RefreshRun: The run, its id is the handle for /forum refresh-status.
+        """
+        run = RefreshRun(self.next_refresh_run, len(threads))
+        self.next_refresh_run += 1
+        self.refresh_runs[run.id] = run
+        # Keep the last few runs around for /forum refresh-status
+        for old_id in sorted(self.refresh_runs)[:-10]:
+            del self.refresh_runs[old_id]
+
+        async def report():
+            while not run.finished:
+                await asyncio.sleep(5)
+                if not run.finished and on_progress:
+                    await on_progress(run)
+
+        async def execute():
+            reporter = asyncio.create_task(report())
+            try:
+                await self.refresh_threads(threads, force, run)
+            finally:
+                run.finished = run.finished or time.monotonic()
+                reporter.cancel()
+            self.logger.info(run.summary())
+            if on_progress:
+                await on_progress(run)
+
+        run.task = asyncio.create_task(execute())
+        return run
+
+    def mark_dirty(self, thread_id):
+        """
+        Queue a thread's note for the next update_notes run.
+
+        Args:
+            thread_id (int): The ID of the thread.
+        """
+        self.dirty_threads.add(thread_id)
+
+    async def refresh_note(self, thread, note_id=None, render_hash=None, force=False):
+        """
+        Refresh a thread's note. The first refresh is applied straight away, refreshes requested within
+        NOTE_EDIT_WINDOW seconds of it are merged into a single edit at the end of the window that renders the latest
+        state.
+
+        Args:
+            thread (discord.Thread): The thread to refresh.
+            note_id (int): The note message ID, looked up if not given.
+            render_hash (str): The stored render hash, looked up if not given.
+            force (bool): Edit the note even if the render hasn't changed.
+
+        Returns:
+            bool: True if the note message was edited.
+        """
+        pending = self.pending_edits.get(thread.id)
+        if pending is not None:
+            # An edit is already waiting for this note and will render whatever is current by then
+            pending["force"] = pending["force"] or force
+            self.edit_stats["saved"] += 1
+            return await asyncio.shield(pending["future"])
+        now = time.monotonic()
+        wait = self.last_edit_at.get(thread.id, 0) + self.note_edit_window - now
+        if wait > 0:
+            pending = {"force": force, "future": asyncio.get_running_loop().create_future()}
+            self.pending_edits[thread.id] = pending
+            result = False
+            try:
+                await asyncio.sleep(wait)
+                # Refreshes asked for from here on need a newer render than this one
+                del self.pending_edits[thread.id]
+                result = await self.apply_note_refresh(thread, note_id, render_hash, pending["force"])
+            finally:
+                # Also when cancelled (e.g. the cog is unloaded) or failing, so the merged refreshes aren't left
+                # waiting on an edit that will never happen
+                if self.pending_edits.get(thread.id) is pending:
+                    del self.pending_edits[thread.id]
+                if not pending["future"].done():
+                    pending["future"].set_result(result)
+            return result
+        return await self.apply_note_refresh(thread, note_id, render_hash, force)
+
+    async def apply_note_refresh(self, thread, note_id=None, render_hash=None, force=False):
+        """
+        Render a thread's note and edit the note message, unless the render matches the one stored last time.
+
+        Args:
+            thread (discord.Thread): The thread to refresh.
+            note_id (int): The note message ID, looked up if not given.
+            render_hash (str): The stored render hash, looked up if not given.
+            force (bool): Edit the note even if the render hasn't changed.
+
+        Returns:
+            bool: True if the note message was edited.
+        """
+        if note_id is None:
+            utils.db_connector().execute(
+                f"SELECT note_id, note_render_hash FROM {utils.table('threads')} WHERE thread_id = %s", (thread.id,))
+            row = utils.db_connector().fetchone()
+            if not row:
+                return False
+            note_id, render_hash = row
+        now = time.monotonic()
+        self.last_edit_at[thread.id] = now
+        if len(self.last_edit_at) > 1000:
+            self.last_edit_at = {k: v for k, v in self.last_edit_at.items() if v > now - self.note_edit_window}
+        embed = await util.build_forum_embed(thread)
+        new_hash = utils.content_hash(embed.to_dict())
+        if new_hash == render_hash and not force:
+            self.logger.debug(f"Note for {thread.name} is up to date.")
+            return False
+        await self.refresh_pacer.wait(thread.id)
+        try:
+            # A partial message saves fetching the note before editing it
+            # The buttons stay as they are, only the embed changes
+            await thread.get_partial_message(note_id).edit(embed=embed, content=None)
+        except discord.errors.NotFound:
+            self.logger.warning(f"Note message {note_id} not found, deleting from database.")
+            utils.db_connector().execute(f"DELETE FROM {utils.table('threads')} WHERE thread_id = %s", (thread.id,))
+            utils.db_connector().commit()
+            self.note_ids.pop(thread.id, None)
+            return False
+        self.edit_stats["edits"] += 1
+        self.logger.info(f"Note {thread.name} was out of date, updated.")
+        utils.db_connector().execute(f"UPDATE {utils.table('threads')} SET note_render_hash = %s WHERE thread_id = %s",
+                                     (new_hash, thread.id))
+        utils.db_connector().commit()
+        return True
 
     @commands.Cog.listener()
     async def on_ready(self):
-        self.update_notes.start()
+        if not self.note_view_registered:
+            self.bot.add_view(EditNoteButtonView(self.bot, self.logger))
+            self.note_view_registered = True
+        if not self.update_notes.is_running():
+            self.update_notes.start()
+        if not self.sticky_reposts.is_running():
+            self.sticky_reposts.start()
+        if not self.rename_scheduler.is_running():
+            self.load_pending_renames()
+            self.rename_scheduler.start()
+
+    def get_member_index(self, guild):
+        """
+        Get the name index of a guild's members, building it the first time.
+
+        Args:
+            guild (discord.Guild): The guild.
+
+        Returns:
+            utils.MemberNameIndex: The index, kept up to date by the member listeners.
+        """
+        if guild.id not in self.member_indexes:
+            self.member_indexes[guild.id] = utils.MemberNameIndex(guild.members)
+            self.logger.info(f"Indexed {len(self.member_indexes[guild.id])} member names for {guild.name}")
+        return self.member_indexes[guild.id]
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        if member.guild.id in self.member_indexes:
+            self.member_indexes[member.guild.id].add(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        if member.guild.id in self.member_indexes:
+            self.member_indexes[member.guild.id].remove(member.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        # Nickname changes
+        if after.guild.id in self.member_indexes and before.display_name != after.display_name:
+            self.member_indexes[after.guild.id].add(after)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before, after):
+        # Username and global display name changes, which apply in every guild
+        if before.name == after.name and before.global_name == after.global_name:
+            return
+        for guild_id, index in self.member_indexes.items():
+            guild = self.bot.get_guild(guild_id)
+            member = guild.get_member(after.id) if guild else None
+            if member is not None:
+                index.add(member)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.member_indexes.pop(guild.id, None)
 
     @commands.Cog.listener()
     async def on_thread_create(self, thread):
@@ -360,20 +722,36 @@ class ThreadsCog(commands.Cog):
             thread (discord.Thread): The created thread.
         """
         if thread.parent.id in await util.get_forum_channels(thread.guild):
+            started = time.monotonic()
             self.logger.info(f"New thread in forum: {thread.parent.name}, {thread.name}")
-            m = await thread.send("Welcome to the thread! This message will be updated when I receive information from "
-                                  "the database!")
             settings = await util.get_settings(thread.guild)
             try:
                 defaultNote = settings["defaultNote"][str(thread.parent.id)]
             except KeyError:
                 defaultNote = settings["defaultNote"]["default"]
             utils.db_connector().execute(
-                f"INSERT INTO {utils.table('threads')} (thread_id, channel_id, note, note_id, note_last_update) VALUES (%s, %s, %s, %s, %s);",
-                (thread.id, thread.parent.id, defaultNote, m.id, util.time_since_epoch())
+                f"INSERT INTO {utils.table('threads')} (thread_id, channel_id, note, note_last_update) VALUES (%s, %s, %s, %s);",
+                (thread.id, thread.parent.id, defaultNote, util.time_since_epoch())
             )
             utils.db_connector().commit()
-            await self.update_notes()
+            # Post the rendered note straight away instead of a placeholder that a refresh has to fix up
+            embed = await util.build_forum_embed(thread)
+            m = await thread.send(embed=embed, view=EditNoteButtonView(store=False))
+            deadline = time.time() + self.repost_interval
+            utils.db_connector().execute(
+                f"UPDATE {utils.table('threads')} SET note_id = %s, note_render_hash = %s, note_repost_at = %s "
+                f"WHERE thread_id = %s", (m.id, utils.content_hash(embed.to_dict()), int(deadline), thread.id))
+            utils.db_connector().commit()
+            self.note_ids[thread.id] = m.id
+            self.repost_deadlines[thread.id] = deadline
+            handled_ms = (time.monotonic() - started) * 1000
+            latency_ms = (m.created_at - thread.created_at).total_seconds() * 1000
+            self.note_post_latency.append(latency_ms)
+            self.note_post_latency = self.note_post_latency[-100:]
+            self.logger.info(f"Note posted in {thread.name} {latency_ms:.0f}ms after the thread was created "
+                             f"({handled_ms:.0f}ms in the handler, average of the last "
+                             f"{len(self.note_post_latency)}: "
+                             f"{sum(self.note_post_latency) / len(self.note_post_latency):.0f}ms)")
 
     @commands.Cog.listener()
     async def on_thread_delete(self, thread):
@@ -387,7 +765,11 @@ class ThreadsCog(commands.Cog):
             self.logger.warning(f"Thread deleted: {thread.name}")
             utils.db_connector().execute(f"DELETE FROM {utils.table('threads')} WHERE thread_id = %s", (thread.id,))
             utils.db_connector().commit()
-            await self.update_notes()
+            self.dirty_threads.discard(thread.id)
+            self.thread_message_counts.pop(thread.id, None)
+            self.note_ids.pop(thread.id, None)
+            self.repost_deadlines.pop(thread.id, None)
+            self.sticky_due.pop(thread.id, None)
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -397,38 +779,154 @@ class ThreadsCog(commands.Cog):
         Args:
             message (discord.Message): The message that was sent.
         """
-        if message.author == self.bot.user:
-            self.logger.info(f"Ignoring self message ({message.content})")
-            return
         try:
             message.channel.parent.id  # Are we inside a thread?
         except AttributeError:
             return
+        if message.channel.parent.id not in await util.get_forum_channels(message.guild):
+            return
+        # Count messages from the gateway instead of asking discord for the thread's history
+        thread_id = message.channel.id
+        if thread_id not in self.thread_message_counts:
+            self.thread_message_counts[thread_id] = message.channel.message_count or 0
+        self.thread_message_counts[thread_id] += 1
+        if message.author == self.bot.user:
+            self.logger.info(f"Ignoring self message ({message.content})")
+            return
         # if the total amount of messages in this thread is less than 2, ignore the message
-        if message.channel.parent.id in await util.get_forum_channels(message.guild) and len(
-                await message.channel.history(limit=2).flatten()) < 2:
+        if self.thread_message_counts[thread_id] < 2:
             self.logger.info(f"Ignoring message in thread {message.channel.name} ({message.content}) (Too small)")
             return
-        if message.channel.parent.id in await util.get_forum_channels(message.guild):
-            # sleep for the bot latency to ensure the message is sent (bot latency is ms, sleep is in seconds)
-            await asyncio.sleep(self.bot.latency / 1000)
-            self.logger.info(f"Trying to find note with an ID of {message.channel.id}")
-            note = await util.get_note_message(message.channel)
-            self.logger.info(f"Returned note: {note}")
-            # The message’s creation time in UTC.
-            if note is not None:
-                note_sent = note.created_at.timestamp()
-            else:
-                note_sent = 0
-            if note_sent < (datetime.datetime.utcnow() - datetime.timedelta(hours=24)).timestamp():
-                new_note = await message.channel.send(embed=await util.build_forum_embed(message.channel),
-                                                      view=EditNoteButtonView(
-                                                          await util.get_all_allowed_users(message.channel), self.bot,
-                                                          self.logger))
-                utils.db_connector().execute(
-                    f"UPDATE {utils.table('threads')} SET note_id = %s, note_last_update = %s WHERE thread_id = %s",
-                    (new_note.id, util.time_since_epoch(), message.channel.id))
-                utils.db_connector().commit()
+        if message.channel.parent.id in await self.get_sticky_channels(message.guild):
+            self.schedule_sticky_repost(thread_id)
+            return
+        if time.time() < self.get_repost_deadline(thread_id):
+            return
+        await self.repost_note(message.channel)
+
+    def load_thread_state(self, thread_id):
+        """
+        Load a thread's note message ID and repost deadline from the database the first time they are needed.
+
+        Args:
+            thread_id (int): The ID of the thread.
+        """
+        utils.db_connector().execute(
+            f"SELECT note_id, note_repost_at FROM {utils.table('threads')} WHERE thread_id = %s", (thread_id,))
+        row = utils.db_connector().fetchone()
+        note_id, repost_at = row if row else (None, None)
+        self.note_ids[thread_id] = note_id
+        if repost_at is None:
+            # Notes from before deadlines were stored, the note's creation time is part of its snowflake
+            repost_at = discord.utils.snowflake_time(note_id).timestamp() + self.repost_interval if note_id else 0
+        self.repost_deadlines[thread_id] = repost_at
+
+    def get_note_id(self, thread_id):
+        """
+        Get the ID of a thread's note message, from memory or, the first time, from the database.
+
+        Args:
+            thread_id (int): The ID of the thread.
+
+        Returns:
+            int: The note message ID, or None if the thread has no note.
+        """
+        if thread_id not in self.note_ids:
+            self.load_thread_state(thread_id)
+        return self.note_ids[thread_id]
+
+    def get_repost_deadline(self, thread_id):
+        """
+        Get when a thread's note should be posted again.
+
+        Args:
+            thread_id (int): The ID of the thread.
+
+        Returns:
+            float: The deadline in epoch seconds.
+        """
+        if thread_id not in self.repost_deadlines:
+            self.load_thread_state(thread_id)
+        return self.repost_deadlines[thread_id]
+
+    async def repost_note(self, thread, delete_old=False):
+        """
+        Post the thread's note again as the newest message.
+
+        Args:
+            thread (discord.Thread): The thread to post the note in.
+            delete_old (bool): Delete the previous note message.
+        """
+        old_note_id = self.get_note_id(thread.id)
+        new_note = await thread.send(embed=await util.build_forum_embed(thread),
+                                     view=EditNoteButtonView(store=False))
+        deadline = time.time() + self.repost_interval
+        utils.db_connector().execute(
+            f"UPDATE {utils.table('threads')} SET note_id = %s, note_last_update = %s, note_repost_at = %s "
+            f"WHERE thread_id = %s", (new_note.id, util.time_since_epoch(), int(deadline), thread.id))
+        utils.db_connector().commit()
+        self.note_ids[thread.id] = new_note.id
+        self.repost_deadlines[thread.id] = deadline
+        if delete_old and old_note_id:
+            try:
+                await thread.get_partial_message(old_note_id).delete()
+            except discord.errors.NotFound:
+                pass
+
+    async def get_sticky_channels(self, guild):
+        """
+        Get the forum channels of a guild whose notes are sticky.
+
+        Args:
+            guild (discord.Guild): The guild.
+
+        Returns:
+            set: The IDs of the sticky channels.
+        """
+        if guild.id not in self.sticky_channels:
+            settings = await util.get_settings(guild)
+            self.sticky_channels[guild.id] = {int(channel_id) for channel_id, enabled in
+                                              settings.get("stickyNotes", {}).items() if enabled}
+        return self.sticky_channels[guild.id]
+
+    def schedule_sticky_repost(self, thread_id):
+        """
+        Repost a thread's note once it has had no new messages for STICKY_DEBOUNCE seconds, every new message pushes
+        the repost back.
+
+        Args:
+            thread_id (int): The ID of the thread.
+        """
+        due = time.time() + self.sticky_debounce
+        self.sticky_due[thread_id] = due
+        heapq.heappush(self.sticky_heap, (due, thread_id))
+        self.sticky_wakeup.set()
+
+    @tasks.loop()
+    async def sticky_reposts(self):
+        """
+        Repost the notes of sticky threads as they come due, sleeping until the earliest one.
+        """
+        now = time.time()
+        while self.sticky_heap and self.sticky_heap[0][0] <= now:
+            due, thread_id = heapq.heappop(self.sticky_heap)
+            if self.sticky_due.get(thread_id) != due:
+                # Pushed back by a later message
+                continue
+            del self.sticky_due[thread_id]
+            thread = self.bot.get_channel(thread_id)
+            if thread is None or thread.last_message_id == self.get_note_id(thread_id):
+                continue
+            try:
+                await self.repost_note(thread, delete_old=True)
+            except discord.HTTPException as e:
+                self.logger.error(f"Failed to repost the note of {thread.name}: {e}")
+        timeout = self.sticky_heap[0][0] - time.time() if self.sticky_heap else None
+        self.sticky_wakeup.clear()
+        try:
+            await asyncio.wait_for(self.sticky_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
 
     @commands.Cog.listener()
     async def on_thread_update(self, before: discord.Thread, after: discord.Thread):
@@ -441,22 +939,13 @@ class ThreadsCog(commands.Cog):
         """
         if after.parent.id in await util.get_forum_channels(after.guild):
             self.logger.info(f"Thread updated: {after.name}")
-            if self.WARNING_COOLDOWN_MESSAGE is not None and (
-                    after.name.replace("🔒 ", "").replace(" (Locked)", "") == before.name.replace("🔒 ", "").replace(
-                " (Locked)", "") or
-                    after.name == before.name):
-                await self.WARNING_COOLDOWN_MESSAGE.delete()
-                self.WARNING_COOLDOWN_MESSAGE = None
+            if before.name != after.name:
+                # <THREAD_NAME> may be part of the note
+                self.mark_dirty(after.id)
             if before.locked and not after.locked:
                 t = await utils.safe_unlock_thread(after, True)
                 if t.upper() != "OK":
-                    self.logger.warning(f"Failed to rename {after.name} (Rate limited {t.split(':')[1]})")
-                    # create a task to rename the thread after the rate limit is lifted
-                    try:
-                        await self.rename_after_cooldown.start(after, after.name.replace("🔒 ", "")
-                                                               .replace(" (Locked)", ""))
-                    except RuntimeError:
-                        self.logger.warning("Rate limit task already running.")
+                    await self.schedule_rename(after, utils.unlocked_name(after.name), t)
                 # remove the locked tag from the thread if it is present
                 for tag in after.applied_tags:
                     if re.match(utils.get_config("AUTO_LOCK_REGEX"), tag.name):
@@ -470,52 +959,136 @@ class ThreadsCog(commands.Cog):
                 if any([re.match(utils.get_config("AUTO_LOCK_REGEX"), tag.name) for tag in after.applied_tags]):
                     t = await utils.safe_lock_thread(after, True)
                     if t.upper() != "OK":
-                        self.logger.warning(f"Failed to rename {after.name} (Rate limited {t.split(':')[1]})")
-                        # create a task to rename the thread after the rate limit is lifted
-                        try:
-                            await self.rename_after_cooldown.start(after, after.name.replace("🔒 ", "")
-                                                                   .replace(" (Locked)", ""))
-                        except RuntimeError:
-                            self.logger.warning("Rate limit task already running.")
+                        await self.schedule_rename(after, utils.locked_name(after.name), t)
                     self.logger.info(f"Thread {after.name} locked due to tag application.")
                 else:
                     t = await utils.safe_unlock_thread(after, True)
                     if t.upper() != "OK":
-                        self.logger.warning(f"Failed to rename {after.name} (Rate limited {t.split(':')[1]})")
-                        # create a task to rename the thread after the rate limit is lifted
-                        try:
-                            await self.rename_after_cooldown.start(after, after.name.replace("🔒 ", "")
-                                                                   .replace(" (Locked)", ""))
-                        except RuntimeError:
-                            self.logger.warning("Rate limit task already running.")
+                        await self.schedule_rename(after, utils.unlocked_name(after.name), t)
                     self.logger.info(f"Thread {after.name} unlocked due to tag removal.")
 
-    @tasks.loop()
-    async def rename_after_cooldown(self, thread: discord.Thread, name: str):
+    def load_pending_renames(self):
         """
-        Rename a thread after the rate limit is lifted.
+        Load the renames that were still waiting for their cooldown when the bot stopped.
+        """
+        utils.db_connector().execute(
+            f"SELECT thread_id, pending_name, pending_rename_at, rename_warning_id FROM {utils.table('threads')} "
+            f"WHERE pending_name IS NOT NULL")
+        for thread_id, name, due, warning_id in utils.db_connector().fetchall():
+            self.pending_renames[thread_id] = (due or 0, name, warning_id)
+            heapq.heappush(self.rename_heap, (due or 0, thread_id))
+        if self.pending_renames:
+            self.logger.info(f"Loaded {len(self.pending_renames)} pending thread renames.")
+
+    async def schedule_rename(self, thread, name, outcome):
+        """
+        Rename a thread once its rename cooldown is over. A thread has at most one pending rename, scheduling another
+        one replaces its name, so the thread ends up with the latest name asked for.
 
         Args:
-            name (str): The new name for the thread.
             thread (discord.Thread): The thread to rename.
+            name (str): The name the thread should get.
+            outcome (str): The "cooldown:<seconds since the last rename>" result of safe_lock_thread/safe_unlock_thread.
+        """
+        elapsed = float(outcome.split(":")[1])
+        self.logger.warning(f"Failed to rename {thread.name} (Rate limited {elapsed:.0f}s ago), renaming to {name} "
+                            f"later")
+        due = int(time.time() + max(300 - elapsed, 0)) + 1
+        previous = self.pending_renames.get(thread.id)
+        warning_id = previous[2] if previous else None
+        content = (f"⚠️ `The thread will be renamed to {name} `{utils.to_discord_timestamp(due, 'R')}` due to a rate "
+                   f"limit`")
+        try:
+            if warning_id:
+                await thread.get_partial_message(warning_id).edit(content=content)
+            else:
+                warning_id = (await thread.send(content)).id
+        except discord.HTTPException as e:
+            self.logger.warning(f"Failed to post the rename warning in {thread.name}: {e}")
+        self.pending_renames[thread.id] = (due, name, warning_id)
+        utils.db_connector().execute(
+            f"UPDATE {utils.table('threads')} SET pending_name = %s, pending_rename_at = %s, rename_warning_id = %s "
+            f"WHERE thread_id = %s", (name, due, warning_id, thread.id))
+        utils.db_connector().commit()
+        heapq.heappush(self.rename_heap, (due, thread.id))
+        self.rename_wakeup.set()
+
+    @tasks.loop()
+    async def rename_scheduler(self):
+        """
+        Apply pending renames as they come due, sleeping until the earliest one.
+        """
+        now = time.time()
+        while self.rename_heap and self.rename_heap[0][0] <= now:
+            due, thread_id = heapq.heappop(self.rename_heap)
+            pending = self.pending_renames.get(thread_id)
+            if pending is None or pending[0] != due:
+                # Replaced by a later schedule_rename
+                continue
+            try:
+                await self.apply_rename(thread_id, pending)
+            except discord.HTTPException as e:
+                self.logger.error(f"Failed to rename thread {thread_id}: {e}")
+                self.clear_pending_rename(thread_id)
+        timeout = self.rename_heap[0][0] - time.time() if self.rename_heap else None
+        self.rename_wakeup.clear()
+        try:
+            await asyncio.wait_for(self.rename_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def apply_rename(self, thread_id, pending):
+        """
+        Rename a thread whose pending rename is due, or push it back if the thread was renamed again in the meantime.
+
+        Args:
+            thread_id (int): The ID of the thread.
+            pending (tuple): The (due, name, warning message ID) of the rename.
+        """
+        due, name, warning_id = pending
+        thread = self.bot.get_channel(thread_id)
+        if thread is None:
+            try:
+                # Locked threads are archived, so they may not be cached
+                thread = await self.bot.fetch_channel(thread_id)
+            except discord.errors.NotFound:
+                self.clear_pending_rename(thread_id)
+                return
+        allowed, remaining = await utils.can_rename(thread)
+        if not allowed:
+            new_due = int(time.time() + remaining) + 1
+            self.pending_renames[thread_id] = (new_due, name, warning_id)
+            heapq.heappush(self.rename_heap, (new_due, thread_id))
+            return
+        if thread.name != name:
+            if thread.archived:
+                # safe_lock_thread archives the thread, and discord only lets an archived thread be unarchived, so
+                # rename it while unarchiving and archive it again after
+                await thread.edit(name=name, archived=False)
+                await thread.edit(archived=True)
+            else:
+                await thread.edit(name=name)
+            await utils.record_rename(thread)
+            self.logger.info(f"Renamed {thread_id} to {name} after the rate limit.")
+        if warning_id:
+            try:
+                await thread.get_partial_message(warning_id).delete()
+            except discord.HTTPException:
+                pass
+        self.clear_pending_rename(thread_id)
+
+    def clear_pending_rename(self, thread_id):
+        """
+        Forget a thread's pending rename.
+
+        Args:
+            thread_id (int): The ID of the thread.
         """
-        can_rename = await utils.can_rename(thread)
-        # time since epoch when the rate limit will be lifted, as float
-        future_timestamp = datetime.datetime.now() + datetime.timedelta(seconds=int(can_rename[1]))
-        self.WARNING_COOLDOWN_MESSAGE = await thread.send(f"⚠️ `The thread will be renamed to {name} `"
-                                                          f"{utils.to_discord_timestamp(future_timestamp.timestamp(), 'R')}` due "
-                                                          f"to a rate limit`")
-        # start a loop to break when the rate limit is lifted
-        while not can_rename[0]:
-            can_rename = await utils.can_rename(thread)
-            self.logger.info(f"Rate limited! {can_rename[1]} seconds left.")
-            if can_rename[0]:
-                break
-            await asyncio.sleep(can_rename[1] if can_rename[1] < 60 else 60)
-        await self.WARNING_COOLDOWN_MESSAGE.edit(content=f"✔ `The thread will be renamed to {name} soon due to a rate "
-                                                         f"limit`")
-        await thread.edit(name=name)
-        return
+        self.pending_renames.pop(thread_id, None)
+        utils.db_connector().execute(
+            f"UPDATE {utils.table('threads')} SET pending_name = NULL, pending_rename_at = NULL, "
+            f"rename_warning_id = NULL WHERE thread_id = %s", (thread_id,))
+        utils.db_connector().commit()
 
     @forum.command(name="setup", description="Set up a channel as a forum channel to track")
     @option(name="channel", description="The channel to set up", required=True, channel=True,
@@ -565,6 +1138,33 @@ class ThreadsCog(commands.Cog):
         modal = NoteModal(title=f"Edit note for {ctx.channel.parent.name}", note=note[0] if note else "No note found")
         await ctx.send_modal(modal)
 
+    @forum.command(name="sticky", description="Keep the note below new messages in a forum channel's threads")
+    @option(name="channel", description="The forum channel", required=True, channel=True,
+            autocomplete=build_thread_choices)
+    @option(name="enabled", description="Whether notes should be sticky", required=True)
+    async def sticky(self, ctx: discord.ApplicationContext, channel: discord.ForumChannel, enabled: bool):
+        """
+        Turn sticky notes on or off for a forum channel. Sticky notes are posted again below new activity once a
+        thread goes quiet, and the previous note is deleted.
+
+        Args:
+            ctx (discord.ApplicationContext): The context of the command.
+            channel (discord.ForumChannel): The channel to change.
+            enabled (bool): Whether notes should be sticky.
+        """
+        if not await util.has_permission(ctx, "manage_threads") or \
+                not ctx.author.guild_permissions.manage_channels:
+            await ctx.respond("❌ `You do not have permission to manage threads`", ephemeral=True)
+            return
+        settings = await util.get_settings(ctx.guild)
+        settings.setdefault("stickyNotes", {})[str(channel.id)] = enabled
+        utils.db_connector().execute(f"UPDATE {utils.table('guilds')} SET settings = %s WHERE guild_id = %s",
+                                     (json.dumps(settings), ctx.guild.id))
+        utils.db_connector().commit()
+        self.sticky_channels.pop(ctx.guild.id, None)
+        await ctx.respond(f"✔ `Notes in {channel.name} are {'now' if enabled else 'no longer'} sticky!`",
+                          ephemeral=True)
+
     @forum.command(name="template", description="Change the template for a forum channel")
     async def template_note(self, ctx: discord.ApplicationContext, channel: discord.ForumChannel):
         """
@@ -588,7 +1188,7 @@ class ThreadsCog(commands.Cog):
                                  note=defaultNote, channel_id=channel.id)
         await ctx.send_modal(modal)
 
-    @forum.command(name="refresh", description="Refresh the note for all forum threads")
+    @forum.command(name="refresh", description="Refresh the note for all forum threads in this server")
     @option(name="channel", description="The channel to refresh notes for", required=False, channel=True,
             autocomplete=build_thread_choices)
     async def update(self, ctx: discord.ApplicationContext, channel: discord.ForumChannel = None):
@@ -597,11 +1197,50 @@ class ThreadsCog(commands.Cog):
 
         Args:
             ctx (discord.ApplicationContext): The context of the command.
-            channel (discord.ForumChannel): The channel to refresh notes for. If None, refresh all notes.
+            channel (discord.ForumChannel): The channel to refresh notes for. If None, refresh all notes in the guild.
         """
-        await ctx.defer()
-        await self.update_notes(channel)
-        await ctx.respond("✔ `Notes refreshed!`", ephemeral=True, delete_after=5)
+        if not await util.has_permission(ctx, "manage_threads"):
+            await ctx.respond("❌ `You do not have permission to manage threads`", ephemeral=True)
+            return
+        if channel:
+            threads = self.select_threads(channel)
+        else:
+            threads = self.select_threads(channel_ids=await util.get_forum_channels(ctx.guild))
+        interaction = ctx.interaction
+        responded = asyncio.Event()
+
+        async def on_progress(run):
+            # A short run can finish before the reply below has been sent, and there is nothing to edit until it is
+            await responded.wait()
+            try:
+                await interaction.edit_original_response(content=f"{'✔' if run.finished else '⏳'} `{run.summary()}`")
+            except discord.HTTPException:
+                # The interaction token only lives for 15 minutes, /forum refresh-status keeps working after that
+                pass
+
+        run = self.start_refresh(threads, force=True, on_progress=on_progress)
+        try:
+            await ctx.respond(f"⏳ `Refresh #{run.id} started for {run.total} thread(s), use /forum refresh-status "
+                              f"{run.id} to check on it.`", ephemeral=True)
+        finally:
+            responded.set()
+
+    @forum.command(name="refresh-status", description="Show the progress of a note refresh")
+    @option(name="run", description="The refresh number given by /forum refresh", required=False)
+    async def refresh_status(self, ctx: discord.ApplicationContext, run: int = None):
+        """
+        Show the progress of a note refresh.
+
+        Args:
+            ctx (discord.ApplicationContext): The context of the command.
+            run (int): The refresh to show, the latest one if None.
+        """
+        if run is None and self.refresh_runs:
+            run = max(self.refresh_runs)
+        if run not in self.refresh_runs:
+            await ctx.respond("❌ `No such refresh`", ephemeral=True, delete_after=5)
+            return
+        await ctx.respond(f"`{self.refresh_runs[run].summary()}`", ephemeral=True)
 
     @forum.command(name="close", description="Close a forum thread")
     async def close(self, ctx: discord.ApplicationContext):
@@ -650,6 +1289,7 @@ class ThreadsCog(commands.Cog):
             f"UPDATE {utils.table('threads')} SET assigned_discord_ids = %s WHERE thread_id = %s",
             (json.dumps(assigned), thread.id))
         utils.db_connector().commit()
+        self.mark_dirty(thread.id)
         await ctx.respond(f"✔ `User {user.name} has been assigned to thread {thread.name}`", ephemeral=True)
 
     @assign.command(name="remove", description="Remove a user from a forum thread")
@@ -683,6 +1323,7 @@ class ThreadsCog(commands.Cog):
             f"UPDATE {utils.table('threads')} SET assigned_discord_ids = %s WHERE thread_id = %s",
             (json.dumps(assigned), thread.id))
         utils.db_connector().commit()
+        self.mark_dirty(thread.id)
         await ctx.respond(f"✔ `User {user.name} has been removed from thread {thread.name}`", ephemeral=True)
 
     @assign.command(name="list", description="List all users assigned to a forum thread")
@@ -1,13 +1,194 @@
+import asyncio
+import contextlib
+import hmac
 import os
 import signal
+import socket
+import sqlite3
+import uuid
 from datetime import datetime
 from pprint import pprint
+from aiohttp import web
 from discord.ext import commands, tasks
+import pymysql as sql
 import logging
 import utils
 import time
 
 
+class CacheStore:
+    """
+    SQLite backed storage for the WebConnector cache.
+
+    Guild, user and role IDs are stored as integers so they come back with the same type they went in with, and every
+    write is its own small transaction so only the rows that changed are touched.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL;")
+        self.connection.execute("PRAGMA synchronous=NORMAL;")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS users (guild_id INTEGER NOT NULL, "
+                                    "user_id INTEGER NOT NULL, username TEXT, discriminator TEXT, roles TEXT, "
+                                    "PRIMARY KEY (guild_id, user_id)) WITHOUT ROWID;")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS roles (guild_id INTEGER NOT NULL, "
+                                    "role_id INTEGER NOT NULL, name TEXT, "
+                                    "PRIMARY KEY (guild_id, role_id)) WITHOUT ROWID;")
+
+    def is_empty(self):
+        return self.connection.execute("SELECT 1 FROM users LIMIT 1;").fetchone() is None and \
+            self.connection.execute("SELECT 1 FROM roles LIMIT 1;").fetchone() is None
+
+    def load(self):
+        """
+        Load the whole cache from disk.
+
+        :return: A tuple of the cache dictionary and the timestamp of the last full build (or None)
+        """
+        cache = {}
+        for guild_id, user_id, username, discriminator, roles in self.connection.execute(
+                "SELECT guild_id, user_id, username, discriminator, roles FROM users;"):
+            guild = cache.setdefault(guild_id, {"users": {}, "roles": {}})
+            guild["users"][user_id] = {
+                "username": username,
+                "discriminator": discriminator,
+                "roles": utils.from_json(roles) if roles else []
+            }
+        for guild_id, role_id, name in self.connection.execute("SELECT guild_id, role_id, name FROM roles;"):
+            guild = cache.setdefault(guild_id, {"users": {}, "roles": {}})
+            guild["roles"][role_id] = {"name": name}
+        timestamp = self.connection.execute("SELECT value FROM meta WHERE key = '_timestamp';").fetchone()
+        return cache, float(timestamp[0]) if timestamp else None
+
+    def delete_user(self, guild_id: int, user_id: int):
+        with self.connection:
+            self.connection.execute("DELETE FROM users WHERE guild_id = ? AND user_id = ?;", (guild_id, user_id))
+
+    def put_users(self, rows: list):
+        """Write several (guild_id, user_id, user) rows in one transaction."""
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO users (guild_id, user_id, username, discriminator, "
+                                        "roles) VALUES (?, ?, ?, ?, ?);",
+                                        [(guild_id, user_id, user.get("username"), user.get("discriminator"),
+                                          utils.to_json(user.get("roles", []))) for guild_id, user_id, user in rows])
+
+    def put_roles(self, rows: list):
+        """Write several (guild_id, role_id, role) rows in one transaction."""
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO roles (guild_id, role_id, name) VALUES (?, ?, ?);",
+                                        [(guild_id, role_id, role.get("name")) for guild_id, role_id, role in rows])
+
+    def delete_role(self, guild_id: int, role_id: int):
+        with self.connection:
+            self.connection.execute("DELETE FROM roles WHERE guild_id = ? AND role_id = ?;", (guild_id, role_id))
+
+    def delete_guild(self, guild_id: int):
+        with self.connection:
+            self.connection.execute("DELETE FROM users WHERE guild_id = ?;", (guild_id,))
+            self.connection.execute("DELETE FROM roles WHERE guild_id = ?;", (guild_id,))
+
+    def sync(self, previous: dict, current: dict, timestamp: float = None):
+        """
+        Persist the difference between two versions of the cache in a single transaction.
+
+        :param previous: The cache as it was last persisted
+        :param current: The cache as it should be persisted now
+        :param timestamp: Optional build timestamp to store alongside the data
+        :return: The number of rows written or deleted
+        """
+        changes = 0
+        with self.connection:
+            for guild_id in previous.keys() - current.keys():
+                self.connection.execute("DELETE FROM users WHERE guild_id = ?;", (guild_id,))
+                self.connection.execute("DELETE FROM roles WHERE guild_id = ?;", (guild_id,))
+                changes += 1
+            for guild_id, guild in current.items():
+                old_guild = previous.get(guild_id, {"users": {}, "roles": {}})
+                for user_id, user in guild["users"].items():
+                    if old_guild["users"].get(user_id) != user:
+                        self.connection.execute("INSERT OR REPLACE INTO users (guild_id, user_id, username, "
+                                                "discriminator, roles) VALUES (?, ?, ?, ?, ?);",
+                                                (guild_id, user_id, user.get("username"), user.get("discriminator"),
+                                                 utils.to_json(user.get("roles", []))))
+                        changes += 1
+                for user_id in old_guild["users"].keys() - guild["users"].keys():
+                    self.connection.execute("DELETE FROM users WHERE guild_id = ? AND user_id = ?;",
+                                            (guild_id, user_id))
+                    changes += 1
+                for role_id, role in guild["roles"].items():
+                    if old_guild["roles"].get(role_id) != role:
+                        self.connection.execute("INSERT OR REPLACE INTO roles (guild_id, role_id, name) "
+                                                "VALUES (?, ?, ?);", (guild_id, role_id, role.get("name")))
+                        changes += 1
+                for role_id in old_guild["roles"].keys() - guild["roles"].keys():
+                    self.connection.execute("DELETE FROM roles WHERE guild_id = ? AND role_id = ?;",
+                                            (guild_id, role_id))
+                    changes += 1
+            if timestamp is not None:
+                self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('_timestamp', ?);",
+                                        (str(timestamp),))
+        return changes
+
+    def checkpoint(self):
+        """Fold the write-ahead log back into the database file so the next start only reads one file."""
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+
+class WriteBuffer:
+    """
+    Collects the users and roles whose cached data changed, so a burst of events for the same key becomes a single
+    write when the buffer is flushed.
+    """
+
+    def __init__(self):
+        self.users = set()
+        self.roles = set()
+        self.stats = {"queued": 0, "coalesced": 0, "flushed": 0, "flushes": 0}
+
+    def __len__(self):
+        return len(self.users) + len(self.roles)
+
+    def mark_user(self, guild_id: int, user_id: int):
+        self._mark(self.users, (guild_id, user_id))
+
+    def mark_role(self, guild_id: int, role_id: int):
+        self._mark(self.roles, (guild_id, role_id))
+
+    def _mark(self, keys: set, key: tuple):
+        self.stats["queued"] += 1
+        if key in keys:
+            self.stats["coalesced"] += 1
+        else:
+            keys.add(key)
+
+    def take(self, keys: set, batch_size: int):
+        """Remove and return up to batch_size keys from one of the sets."""
+        batch = []
+        while keys and len(batch) < batch_size:
+            batch.append(keys.pop())
+        return batch
+
+
+def int_keys(cache: dict):
+    """
+    Convert a cache loaded from the legacy cache.json (where JSON turned every key into a string) back to integer keys.
+
+    :param cache: The cache as loaded from JSON
+    :return: The cache with integer guild, user and role IDs
+    """
+    out = {}
+    for guild_id, guild in cache.items():
+        out[int(guild_id)] = {
+            "users": {int(user_id): {**user, "roles": [int(role) for role in user.get("roles", [])]}
+                      for user_id, user in guild.get("users", {}).items()},
+            "roles": {int(role_id): role for role_id, role in guild.get("roles", {}).items()}
+        }
+    return out
+
+
 class WebConnectorCog(commands.Cog):
     def __init__(self, bot, logger):
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -25,6 +206,24 @@ class WebConnectorCog(commands.Cog):
             import atexit
             atexit.register(self.on_shutdown)
         self.logger.debug("Signal handlers hooked")
+        # Jobs are pushed to us through the local API, polling is only a fallback that backs off while idle
+        self.job_interval = int(utils.get_config("JOB_INTERVAL"))
+        self.job_max_interval = int(os.getenv("JOB_MAX_INTERVAL", "300"))
+        self.job_poll_interval = self.job_interval
+        self.jobs_available = asyncio.Event()
+        # Jobs are claimed with a lease so several bot instances can share JOBS_TABLE without running a job twice
+        self.worker_id = os.getenv("JOB_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+        self.job_lease_seconds = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+        self.job_batch_size = int(os.getenv("JOB_BATCH_SIZE", "50"))
+        self.job_aging_seconds = int(os.getenv("JOB_AGING_SECONDS", "300"))
+        # Failed jobs are retried with exponential backoff, and parked as "dead" after JOB_MAX_ATTEMPTS
+        self.job_max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+        self.job_retry_seconds = int(os.getenv("JOB_RETRY_SECONDS", "30"))
+        self.job_retry_max_seconds = int(os.getenv("JOB_RETRY_MAX_SECONDS", "3600"))
+        # Jobs run concurrently, but two jobs for the same member never overlap
+        self.job_pool = utils.JobPool(int(os.getenv("JOB_CONCURRENCY", "5")))
+        self.job_stats = {"jobs": 0, "rest_calls": 0, "latency_ms": 0.0}
+        self.web_runner = None
         self.logger.info(f"Starting check jobs loop, interval: {str(utils.get_config('JOB_INTERVAL'))}")
         self.check_jobs.start()
 
@@ -32,21 +231,42 @@ class WebConnectorCog(commands.Cog):
         self.cache = {}
         self.cache_expiry_seconds = 3600  # 1 hour expiry, adjust as needed
         self.cache_timestamp = None
-        if os.path.exists("cache.json"):
-            with open("cache.json", "r") as f:
-                cache_data = utils.from_json(f.read())
-                if isinstance(cache_data, dict) and "_timestamp" in cache_data:
-                    self.cache = cache_data.get("data", {})
-                    self.cache_timestamp = cache_data["_timestamp"]
-                else:
-                    self.cache = cache_data
-                    self.cache_timestamp = None
+        # username -> user_id for every guild in the cache, so jobs can find members by name without a scan
+        self.name_index = {}
+        # guild_id -> role_id -> user IDs, built on demand for the API
+        self.role_members = {}
+        # ROLE_TABLE only needs writing while the webapp still reads it instead of the API
+        self.role_table_sync = os.getenv("ROLE_TABLE_SYNC", "true").lower() != "false"
+        self.store = CacheStore(os.getenv("CACHE_LOCATION", "cache.db"))
+        # Hash of the DiscordRoles value stored for each (guild_id, user_id), loaded from ROLE_TABLE on first sync
+        self.role_hashes = None
+        self.role_sync_stats = {"written": 0, "skipped": 0}
+        # roleID -> name as stored in the role names table, loaded on first sync
+        self.role_names = None
+        # Users and roles changed by events, written to the cache store and the database by flush_writes
+        self.writes = WriteBuffer()
+        self.write_interval = float(os.getenv("WRITE_BEHIND_INTERVAL", "2"))
+        self.write_batch_size = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+        # Retention for JOBS_TABLE and ROLE_TABLE, see maintenance
+        self.job_retention_days = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+        self.role_retention_days = int(os.getenv("ROLE_RETENTION_DAYS", "30"))
+        self.maintenance_batch_size = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+        self.maintenance_time_budget = float(os.getenv("MAINTENANCE_TIME_BUDGET", "30"))
+        self.archive_dir = os.getenv("MAINTENANCE_ARCHIVE_DIR", "")
+        self.migrate_json_cache()
+        self.load_cache()
 
         self.sync_cache.start()
+        self.deliver_notifications.start()
+        self.write_behind.change_interval(seconds=self.write_interval)
+        self.write_behind.start()
+        self.maintenance.change_interval(hours=float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "6")))
+        self.maintenance.start()
 
     @commands.Cog.listener()
     async def on_ready(self):
         await self.bot.wait_until_ready()
+        await self.start_api()
         await self.ensure_fresh_cache()
         if len(self.cache.keys()) == 0:
             await self.build_cache()
@@ -59,33 +279,229 @@ class WebConnectorCog(commands.Cog):
 
     def on_shutdown(self):
         self.logger.info("Freezing cache!")
-        self.save_cache()
+        try:
+            self.flush_writes()
+        except (sql.Error, sqlite3.Error) as e:
+            self.logger.error(f"Failed to flush buffered writes: {e}")
+        self.store.checkpoint()
+        if self.web_runner is not None:
+            self.bot.loop.create_task(self.web_runner.cleanup())
+            self.web_runner = None
         self.logger.info("Shutting down WebConnectorCog")
 
-    def load_cache(self):
-        """Load cache from file, handling expiry and structure."""
-        self.cache = {}
-        self.cache_timestamp = None
-        if os.path.exists("cache.json"):
+    def cog_unload(self):
+        self.check_jobs.cancel()
+        self.sync_cache.cancel()
+        self.deliver_notifications.cancel()
+        self.write_behind.cancel()
+        self.maintenance.cancel()
+        self.flush_writes()
+        self.bot.loop.create_task(utils.notifier.close())
+        if self.web_runner is not None:
+            self.bot.loop.create_task(self.web_runner.cleanup())
+            self.web_runner = None
+
+    async def start_api(self):
+        """Start the local HTTP API the webapp uses to push jobs, this only happens once even if on_ready fires again."""
+        if self.web_runner is not None:
+            return
+        app = web.Application(middlewares=[self.api_auth])
+        app.add_routes([
+            web.post("/jobs", self.api_add_job),
+            web.post("/jobs/notify", self.api_notify_jobs),
+            web.get("/guilds/{guild_id}/users", self.api_find_user),
+            web.get("/guilds/{guild_id}/users/{user_id}", self.api_get_user),
+            web.get("/guilds/{guild_id}/users/{user_id}/roles", self.api_get_user_roles),
+            web.get("/guilds/{guild_id}/roles/{role_id}/members", self.api_get_role_members),
+        ])
+        self.web_runner = web.AppRunner(app)
+        await self.web_runner.setup()
+        host = os.getenv("API_HOST", "127.0.0.1")
+        port = int(os.getenv("API_PORT", "8765"))
+        await web.TCPSite(self.web_runner, host, port).start()
+        self.logger.info(f"Local API listening on http://{host}:{port}")
+
+    @web.middleware
+    async def api_auth(self, request, handler):
+        """Reject any request that does not carry the shared WEBAPP_KEY in the SS-API-KEY header."""
+        key = os.getenv("WEBAPP_KEY", "")
+        if not key or not hmac.compare_digest(request.headers.get("SS-API-KEY", ""), key):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        return await handler(request)
+
+    async def api_add_job(self, request):
+        """Queue a job sent by the webapp and wake the job worker straight away."""
+        try:
+            job = await request.json()
+        except ValueError:
+            return web.json_response({"error": "invalid JSON"}, status=400)
+        if not isinstance(job, dict) or "endpoint" not in job:
+            return web.json_response({"error": "job must be an object with an 'endpoint'"}, status=400)
+        if job["endpoint"] not in ("update-user-roles", "bulk-update-user-roles"):
+            return web.json_response({"error": f"unknown endpoint {job['endpoint']!r}"}, status=400)
+        if not isinstance(job.get("data", {}), dict):
+            return web.json_response({"error": "'data' must be an object"}, status=400)
+        priority = job.get("priority", 0)
+        if isinstance(priority, bool) or not isinstance(priority, int):
+            return web.json_response({"error": "'priority' must be an integer"}, status=400)
+        db = utils.db_connector()
+        db.execute(f"INSERT INTO {os.getenv('JOBS_TABLE')} (process_id, payload, status, priority) "
+                   f"VALUES (%s, %s, %s, %s);",
+                   (utils.get_config("JOB_BOT_NAME"), utils.to_json(job), "pending", priority))
+        db.commit()
+        job_id = db.cursor.lastrowid
+        self.logger.info(f"Job {job_id} pushed through the API")
+        self.wake_jobs()
+        return web.json_response({"id": job_id, "status": "pending"}, status=202)
+
+    async def api_notify_jobs(self, request):
+        """The webapp inserted jobs itself, just wake the job worker."""
+        self.wake_jobs()
+        return web.json_response({"status": "ok"}, status=202)
+
+    def api_response(self, request, data):
+        """
+        Send read-only data with an ETag, answering 304 Not Modified when the webapp already has this version.
+        """
+        body = utils.to_json(data)
+        etag = f'"{utils.content_hash(body)[:32]}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+            return web.Response(status=304, headers=headers)
+        return web.Response(text=body, content_type="application/json", headers=headers)
+
+    def api_guild(self, request):
+        """Get the cached guild a request refers to, raising a HTTP error if it is unknown."""
+        try:
+            guild_id = int(request.match_info["guild_id"])
+        except ValueError:
+            raise web.HTTPBadRequest(text='{"error": "invalid guild id"}', content_type="application/json")
+        if guild_id not in self.cache:
+            raise web.HTTPNotFound(text='{"error": "unknown guild"}', content_type="application/json")
+        return guild_id, self.cache[guild_id]
+
+    def api_user_data(self, guild, user_id):
+        """Shape a cached user for the API, IDs are sent as strings so javascript doesn't round them."""
+        user = guild["users"][user_id]
+        return {
+            "id": str(user_id),
+            "username": user["username"],
+            "discriminator": user["discriminator"],
+            "roles": self.api_roles_data(guild, user["roles"])
+        }
+
+    @staticmethod
+    def api_roles_data(guild, role_ids):
+        return [{"id": str(role_id), "name": guild["roles"][role_id]["name"]}
+                for role_id in role_ids if role_id in guild["roles"]]
+
+    def api_cached_user_id(self, request, guild):
+        try:
+            user_id = int(request.match_info["user_id"])
+        except ValueError:
+            raise web.HTTPBadRequest(text='{"error": "invalid user id"}', content_type="application/json")
+        if user_id not in guild["users"]:
+            raise web.HTTPNotFound(text='{"error": "unknown user"}', content_type="application/json")
+        return user_id
+
+    async def api_get_user(self, request):
+        """GET /guilds/{guild_id}/users/{user_id}"""
+        guild_id, guild = self.api_guild(request)
+        return self.api_response(request, self.api_user_data(guild, self.api_cached_user_id(request, guild)))
+
+    async def api_find_user(self, request):
+        """GET /guilds/{guild_id}/users?name=..."""
+        guild_id, guild = self.api_guild(request)
+        name = request.query.get("name")
+        if not name:
+            return web.json_response({"error": "a name query parameter is required"}, status=400)
+        user_id = self.name_index.get(guild_id, {}).get(name)
+        if user_id is None or user_id not in guild["users"]:
+            return web.json_response({"error": "unknown user"}, status=404)
+        return self.api_response(request, self.api_user_data(guild, user_id))
+
+    async def api_get_user_roles(self, request):
+        """GET /guilds/{guild_id}/users/{user_id}/roles"""
+        guild_id, guild = self.api_guild(request)
+        user_id = self.api_cached_user_id(request, guild)
+        return self.api_response(request, self.api_roles_data(guild, guild["users"][user_id]["roles"]))
+
+    async def api_get_role_members(self, request):
+        """GET /guilds/{guild_id}/roles/{role_id}/members"""
+        guild_id, guild = self.api_guild(request)
+        try:
+            role_id = int(request.match_info["role_id"])
+        except ValueError:
+            return web.json_response({"error": "invalid role id"}, status=400)
+        if role_id not in guild["roles"]:
+            return web.json_response({"error": "unknown role"}, status=404)
+        members = sorted(self.get_role_members(guild_id).get(role_id, ()))
+        return self.api_response(request, {
+            "role": {"id": str(role_id), "name": guild["roles"][role_id]["name"]},
+            "members": [{"id": str(user_id), "username": guild["users"][user_id]["username"]} for user_id in members]
+        })
+
+    def get_role_members(self, guild_id):
+        """
+        Get the role_id -> set of user IDs index for a guild, built from the cache on first use and dropped by
+        forget_role_members whenever a member's roles change.
+        """
+        if guild_id not in self.role_members:
+            index = {}
+            for user_id, user in self.cache[guild_id]["users"].items():
+                for role_id in user["roles"]:
+                    index.setdefault(role_id, set()).add(user_id)
+            self.role_members[guild_id] = index
+        return self.role_members[guild_id]
+
+    def forget_role_members(self, guild_id=None):
+        """Drop the role members index of a guild (or of every guild), it is rebuilt on the next request."""
+        if guild_id is None:
+            self.role_members.clear()
+        else:
+            self.role_members.pop(guild_id, None)
+
+    def wake_jobs(self):
+        self.job_poll_interval = self.job_interval
+        self.jobs_available.set()
+
+    def migrate_json_cache(self):
+        """Import a legacy cache.json into the cache store once, then move it out of the way."""
+        if not os.path.exists("cache.json") or not self.store.is_empty():
+            return
+        try:
             with open("cache.json", "r") as f:
-                try:
-                    cache_data = utils.from_json(f.read())
-                    if isinstance(cache_data, dict) and "_timestamp" in cache_data and "data" in cache_data:
-                        self.cache = cache_data["data"]
-                        self.cache_timestamp = cache_data["_timestamp"]
-                    else:
-                        self.cache = cache_data
-                        self.cache_timestamp = None
-                except Exception as e:
-                    self.logger.error(f"Failed to load cache: {e}")
-                    self.cache = {}
-                    self.cache_timestamp = None
-
-    def save_cache(self):
-        """Save cache to file with timestamp."""
-        cache_data = {"_timestamp": time.time(), "data": self.cache}
-        with open("cache.json", "w") as f:
-            f.write(utils.to_json(cache_data))
+                cache_data = utils.from_json(f.read())
+            if isinstance(cache_data, dict) and "_timestamp" in cache_data and "data" in cache_data:
+                self.store.sync({}, int_keys(cache_data["data"]), cache_data["_timestamp"])
+            else:
+                self.store.sync({}, int_keys(cache_data))
+        except Exception as e:
+            self.logger.error(f"Failed to migrate cache.json: {e}")
+            return
+        os.replace("cache.json", "cache.json.migrated")
+        self.logger.info("Migrated cache.json to the cache store")
+
+    def load_cache(self):
+        """Load cache from the cache store, handling expiry and structure."""
+        try:
+            self.cache, self.cache_timestamp = self.store.load()
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to load cache: {e}")
+            self.cache = {}
+            self.cache_timestamp = None
+        self.build_name_index()
+
+    def build_name_index(self):
+        """Rebuild the username -> user_id index from the cache."""
+        self.name_index = {guild_id: {user["username"]: user_id for user_id, user in guild["users"].items()}
+                           for guild_id, guild in self.cache.items()}
+
+    def save_cache(self, previous: dict = None):
+        """Persist the rows that changed since `previous` (the last persisted cache) and stamp the build time."""
+        changes = self.store.sync(previous if previous is not None else self.store.load()[0], self.cache,
+                                  self.cache_timestamp)
+        self.logger.debug(f"Cache saved ({changes} rows changed)")
 
     def is_cache_expired(self):
         if self.cache_timestamp is None:
@@ -94,59 +510,160 @@ class WebConnectorCog(commands.Cog):
 
     async def build_cache(self):
         """Rebuild the cache from scratch, only for guilds the bot is currently in."""
-        self.cache = {}
+        previous = self.cache
+        # Built on the side and swapped in at the end, the API, jobs and listeners keep using the old cache meanwhile
+        cache = {}
         for guild in self.bot.guilds:
             self.logger.info(f"Connected to {guild.name}")
-            users = await guild.fetch_members().flatten()
-            self.cache[guild.id] = {
-                "users": {},
-                "roles": {}
-            }
-            for user in users:
-                self.cache[guild.id]["users"][user.id] = {
-                    "username": user.name,
-                    "discriminator": user.discriminator,
-                    "roles": [role.id for role in user.roles]
-                }
-            for role in guild.roles:
-                self.cache[guild.id]["roles"][role.id] = {
-                    "name": role.name
-                }
-        self.save_cache()
+            cache[guild.id] = await self.fetch_guild_entry(guild)
+        self.cache = cache
+        self.cache_timestamp = time.time()
+        self.build_name_index()
+        self.forget_role_members()
+        self.save_cache(previous)
+
+    @staticmethod
+    def member_entry(member):
+        """The cache entry for a single member."""
+        return {
+            "username": member.name,
+            "discriminator": member.discriminator,
+            "roles": [role.id for role in member.roles]
+        }
+
+    async def fetch_guild_entry(self, guild):
+        """Fetch a guild's members from discord and return its cache entry."""
+        users = await guild.fetch_members().flatten()
+        return {
+            "users": {user.id: self.member_entry(user) for user in users},
+            "roles": {role.id: {"name": role.name} for role in guild.roles}
+        }
+
+    async def cache_guild(self, guild):
+        """Add (or refresh) a single guild in the cache, without touching any other guild."""
+        entry = await self.fetch_guild_entry(guild)
+        previous = {guild.id: self.cache[guild.id]} if guild.id in self.cache else {}
+        self.cache[guild.id] = entry
+        self.forget_role_members(guild.id)
+        self.name_index[guild.id] = {user["username"]: user_id for user_id, user in entry["users"].items()}
+        changes = self.store.sync(previous, {guild.id: entry})
+        for role_id in entry["roles"]:
+            self.writes.mark_role(guild.id, role_id)
+        for user_id in entry["users"]:
+            self.writes.mark_user(guild.id, user_id)
+        self.logger.info(f"Cached guild {guild.name} ({len(entry['users'])} members, {changes} rows changed)")
+
+    def drop_guild(self, guild_id):
+        """Remove a single guild from the cache."""
+        self.cache.pop(guild_id, None)
+        self.forget_role_members(guild_id)
+        self.name_index.pop(guild_id, None)
+        self.store.delete_guild(guild_id)
+        self.mark_left(guild_id)
+
+    def cache_member(self, member):
+        """Add (or refresh) a single member in the cache."""
+        user = self.member_entry(member)
+        self.cache[member.guild.id]["users"][member.id] = user
+        self.forget_role_members(member.guild.id)
+        self.name_index.setdefault(member.guild.id, {})[member.name] = member.id
+        self.writes.mark_user(member.guild.id, member.id)
+
+    def drop_member(self, guild_id, user_id):
+        """Remove a single member from the cache."""
+        user = self.cache.get(guild_id, {}).get("users", {}).pop(user_id, None)
+        if user is None:
+            return
+        self.forget_role_members(guild_id)
+        guild_index = self.name_index.get(guild_id, {})
+        if guild_index.get(user["username"]) == user_id:
+            del guild_index[user["username"]]
+        self.store.delete_user(guild_id, user_id)
+        self.mark_left(guild_id, user_id)
+
+    def mark_left(self, guild_id, user_id=None):
+        """
+        Stamp the ROLE_TABLE rows of a member (or of a whole guild) with the time they left, prune_role_rows deletes
+        them ROLE_RETENTION_DAYS later. LastUpdate is kept as it is, it records the last role change.
+        """
+        if user_id is None:
+            where, params = "guildID = %s", (guild_id,)
+        else:
+            where, params = "guildID = %s AND userID = %s", (guild_id, user_id)
+        try:
+            utils.db_connector().execute(f"UPDATE `{os.getenv('ROLE_TABLE')}` SET LeftAt = NOW(), "
+                                         f"LastUpdate = LastUpdate WHERE {where};", params)
+            utils.db_connector().commit()
+        except sql.Error as e:
+            self.logger.error(f"Failed to record that {user_id or 'the bot'} left guild {guild_id}: {e}")
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        self.logger.info(f"Joined guild {guild.name} ({guild.id})")
+        await self.cache_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.logger.info(f"Left guild {guild.name} ({guild.id})")
+        self.drop_guild(guild.id)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        if member.guild.id not in self.cache:
+            await self.cache_guild(member.guild)
+        else:
+            self.cache_member(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.drop_member(member.guild.id, member.id)
 
     async def ensure_fresh_cache(self):
-        self.load_cache()
+        # The store was loaded once in __init__. on_ready also runs after reconnects, and loading it again then would
+        # throw away changes the write buffer hasn't flushed yet.
         # Remove any guilds from cache that the bot is not in
         valid_guild_ids = {guild.id for guild in self.bot.guilds}
         removed = [gid for gid in list(self.cache.keys()) if gid not in valid_guild_ids]
         for gid in removed:
-            del self.cache[gid]
-        if self.is_cache_expired() or removed:
-            self.logger.info("Cache expired, missing, or contained stale guilds. Rebuilding cache from Discord.")
+            self.drop_guild(gid)
+        if self.is_cache_expired():
+            self.logger.info("Cache expired or missing. Rebuilding cache from Discord.")
             await self.build_cache()
+            return
+        # Guilds joined while the bot was offline
+        for guild in self.bot.guilds:
+            if guild.id not in self.cache:
+                await self.cache_guild(guild)
 
     @commands.Cog.listener()
     async def on_member_update(self, before, after):
+        if after.guild.id not in self.cache:
+            self.logger.warning(f"{after.guild.id} not in cache, caching guild")
+            await self.cache_guild(after.guild)
+        elif after.id not in self.cache[after.guild.id]["users"]:
+            self.cache_member(after)
         if before.roles != after.roles:  # If roles have changed
             self.logger.info(f"{before} roles changed from {before.roles} to {after.roles}")
             # update cache
-            try:
-                self.cache[after.guild.id]["users"][after.id]["roles"] = [role.id for role in after.roles]
-            except KeyError:
-                self.logger.warning(f"KeyError: {after.guild.id} not in cache, building cache")
-                await self.build_cache()
-                self.cache[after.guild.id]["users"][after.id]["roles"] = [role.id for role in after.roles]
-            self.sync_user_roles_to_db(after.guild.id, after.id)
+            self.cache[after.guild.id]["users"][after.id]["roles"] = [role.id for role in after.roles]
+            self.forget_role_members(after.guild.id)
+            self.writes.mark_user(after.guild.id, after.id)
         # if username changed
         if before.name != after.name:
             self.logger.info(f"{before} username changed from {before.name} to {after.name}")
             self.cache[after.guild.id]["users"][after.id]["username"] = after.name
+            guild_index = self.name_index.setdefault(after.guild.id, {})
+            if guild_index.get(before.name) == after.id:
+                del guild_index[before.name]
+            guild_index[after.name] = after.id
+            self.writes.mark_user(after.guild.id, after.id)
             # Notify webapp directly
             utils.notify_username_changed(after.id, before.name, after.name)
         # if discriminator changed
         if before.discriminator != after.discriminator:
             self.logger.info(f"{before} discriminator changed from {before.discriminator} to {after.discriminator}")
             self.cache[after.guild.id]["users"][after.id]["discriminator"] = after.discriminator
+            self.writes.mark_user(after.guild.id, after.id)
 
     @commands.Cog.listener()
     async def on_guild_update(self, before, after):
@@ -156,26 +673,327 @@ class WebConnectorCog(commands.Cog):
             settings = await utils.get_settings(after)
             pprint(settings)
 
-    @tasks.loop(seconds=int(utils.get_config("JOB_INTERVAL")))
+    @tasks.loop()
     async def check_jobs(self):
-        print(f"Checking jobs at {datetime.now()}, name: {utils.get_config('JOB_BOT_NAME')}, table: {os.getenv('JOBS_TABLE')}")
-        db = utils.db_connector()
-        db.execute(f"SELECT * FROM {os.getenv('JOBS_TABLE')} WHERE {os.getenv('JOBS_TABLE')}.process_id = %s AND {os.getenv('JOBS_TABLE')}.status = %s;",
-                   (utils.get_config("JOB_BOT_NAME"), "pending"))
-        db.commit()  # Ensure the SELECT statement is committed
-        jobs = db.fetchall()
-        print(f"Found {len(jobs)} jobs")
-        jobs = sorted(jobs, key=lambda x: (x[4], x[5]))
+        # Sleep until a job is pushed or the poll interval runs out, whichever comes first
+        try:
+            await asyncio.wait_for(self.jobs_available.wait(), timeout=self.job_poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self.jobs_available.clear()
+        # Claim only once the bot can run the jobs, so the leases don't tick away during startup
+        await self.bot.wait_until_ready()
+        self.logger.debug(f"Checking jobs at {datetime.now()}, name: {utils.get_config('JOB_BOT_NAME')}, "
+                          f"table: {os.getenv('JOBS_TABLE')}")
+        jobs = self.claim_jobs()
+        self.logger.debug(f"Claimed {len(jobs)} jobs")
+        # Poll at JOB_INTERVAL while there is work, back off up to JOB_MAX_INTERVAL while the queue is empty
+        if jobs:
+            self.job_poll_interval = self.job_interval
+        else:
+            self.job_poll_interval = min(self.job_poll_interval * 2, self.job_max_interval)
         if len(jobs) > 0:
-            await self.bot.wait_until_ready()
-            for job in jobs:
-                self.logger.info(f"Processing job id {job[0]}")
-                status = await utils.process_job(utils.from_json(job[2]), self.bot, self.logger, self.cache)
-                if status:
-                    utils.db_connector().execute(f"UPDATE {os.getenv('JOBS_TABLE')} SET status = %s WHERE id = %s;", ("completed", job[0]))
-                    utils.db_connector().commit()
-                else:
-                    self.logger.error(f"Job {job[0]} failed!")
+            # The whole batch shares one lease, kept alive while its jobs wait for a slot or run
+            heartbeat = asyncio.create_task(self.keep_lease(jobs[0][2]))
+            try:
+                results = await asyncio.gather(*[self.run_job(*job) for job in jobs], return_exceptions=True)
+            finally:
+                heartbeat.cancel()
+            for job, result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    self.logger.error(f"Job {job[0]} raised {result!r}")
+                    self.fail_job(job[0], job[2], repr(result))
+            if self.job_stats["jobs"]:
+                self.logger.info(f"Jobs so far: {self.job_stats['jobs']}, average latency "
+                                 f"{self.job_stats['latency_ms'] / self.job_stats['jobs']:.1f}ms, average REST calls "
+                                 f"{self.job_stats['rest_calls'] / self.job_stats['jobs']:.2f} per job")
+            if len(jobs) >= self.job_batch_size:
+                # There is probably more waiting, don't sleep before the next batch
+                self.jobs_available.set()
+
+    async def run_job(self, job_id, payload, lease_id):
+        """
+        Run a single claimed job inside the job pool, keyed on the member it changes.
+        """
+        try:
+            job = utils.from_json(payload)
+        except (TypeError, ValueError) as e:
+            self.logger.error(f"Job {job_id} has an unreadable payload: {e}")
+            self.fail_job(job_id, lease_id, f"Unreadable payload: {e}", permanent=True)
+            return
+        if job.get("endpoint") == "bulk-update-user-roles":
+            # Bulk jobs lock each member they change themselves. Holding a slot while waiting for those locks would
+            # take the locks in the opposite order to slot() and can deadlock with single jobs for the same members.
+            context = contextlib.nullcontext()
+        else:
+            # Lock on the member ID like bulk jobs do, a job addressed by username must not run alongside one
+            # addressed by ID (or a bulk entry) for the same member
+            try:
+                member = utils.resolve_member(utils.sort_guilds(self.bot), job.get("data", {}), self.name_index)
+            except (AttributeError, TypeError, ValueError):
+                # process_job reports the malformed data
+                member = None
+            context = self.job_pool.slot(str(member.id) if member else None)
+        async with context:
+            self.logger.info(f"Processing job id {job_id}")
+            stats = {}
+            status = await utils.process_job(job, self.bot, self.logger, self.cache, stats, pool=self.job_pool,
+                                             name_index=self.name_index)
+            self.job_stats["jobs"] += 1
+            self.job_stats["rest_calls"] += stats.get("rest_calls", 0)
+            self.job_stats["latency_ms"] += stats.get("latency_ms", 0)
+            self.logger.info(f"Job {job_id} took {stats.get('latency_ms')}ms and {stats.get('rest_calls')} REST call(s)")
+            if "retry_after" in stats:
+                self.logger.warning(f"Rate limited while running job {job_id}, pausing jobs for "
+                                    f"{stats['retry_after']}s")
+                self.job_pool.pause(stats["retry_after"])
+        if status:
+            self.complete_job(job_id, lease_id)
+        else:
+            self.logger.error(f"Job {job_id} failed!")
+            self.fail_job(job_id, lease_id, stats.get("error", "Unknown error"), stats.get("permanent", False))
+
+    def claim_jobs(self):
+        """
+        Atomically claim the next batch of jobs for this worker. Only job IDs are read to pick the batch (using the
+        queue indexes and a LIMIT, so the cost doesn't grow with the backlog) and payloads are only loaded for the
+        jobs that were actually claimed.
+
+        :return: A list of (job id, payload, lease id) tuples in the order they should run
+        """
+        jobs_table = os.getenv('JOBS_TABLE')
+        process_id = utils.get_config("JOB_BOT_NAME")
+        db = utils.db_connector()
+        # Hand jobs whose lease ran out (their worker died or hung) back to the queue, this counts as an attempt so a
+        # job that keeps crashing its worker ends up dead
+        db.execute(f"UPDATE {jobs_table} SET status = IF(attempts + 1 >= %s, %s, %s), last_error = %s, "
+                   f"attempts = attempts + 1, worker_id = NULL, lease_id = NULL, lease_expires = NULL "
+                   f"WHERE process_id = %s AND status = %s AND lease_expires < NOW();",
+                   (self.job_max_attempts, "dead", "pending", "Lease expired", process_id, "running"))
+        db.commit()
+        if db.cursor.rowcount:
+            self.logger.warning(f"Reclaimed {db.cursor.rowcount} job(s) with an expired lease")
+        # Jobs that have waited longer than JOB_AGING_SECONDS get the first few slots, oldest first, so a steady
+        # stream of high priority jobs can't starve them
+        db.execute(f"SELECT id FROM {jobs_table} WHERE process_id = %s AND status = %s "
+                   f"AND time_added < NOW() - INTERVAL %s SECOND "
+                   f"AND (next_attempt_at IS NULL OR next_attempt_at <= NOW()) ORDER BY time_added LIMIT %s;",
+                   (process_id, "pending", self.job_aging_seconds, max(1, self.job_batch_size // 4)))
+        job_ids = [row[0] for row in db.fetchall()]
+        db.execute(f"SELECT id FROM {jobs_table} WHERE process_id = %s AND status = %s "
+                   f"AND (next_attempt_at IS NULL OR next_attempt_at <= NOW()) "
+                   f"ORDER BY priority, time_added LIMIT %s;", (process_id, "pending", self.job_batch_size))
+        job_ids += [row[0] for row in db.fetchall() if row[0] not in job_ids]
+        job_ids = job_ids[:self.job_batch_size]
+        if not job_ids:
+            return []
+        lease_id = uuid.uuid4().hex
+        placeholders = ", ".join(["%s"] * len(job_ids))
+        # The status check makes the claim atomic, a job another worker claimed in the meantime is simply skipped
+        db.execute(f"UPDATE {jobs_table} SET status = %s, worker_id = %s, lease_id = %s, "
+                   f"lease_expires = NOW() + INTERVAL %s SECOND WHERE id IN ({placeholders}) AND status = %s;",
+                   ["running", self.worker_id, lease_id, self.job_lease_seconds] + job_ids + ["pending"])
+        db.commit()
+        if db.cursor.rowcount == 0:
+            return []
+        db.execute(f"SELECT id, payload FROM {jobs_table} WHERE lease_id = %s;", (lease_id,))
+        claimed = {job[0]: job[1] for job in db.fetchall()}
+        return [(job_id, claimed[job_id], lease_id) for job_id in job_ids if job_id in claimed]
+
+    async def keep_lease(self, lease_id):
+        """
+        Push the lease of a claimed batch forward every third of JOB_LEASE_SECONDS, so jobs that wait for a slot or run
+        for a long time (bulk jobs under rate limits) aren't reclaimed and run again by another worker. Only jobs still
+        running are renewed, finished and failed jobs no longer hold the lease.
+        """
+        while True:
+            await asyncio.sleep(self.job_lease_seconds / 3)
+            db = utils.db_connector()
+            try:
+                db.execute(f"UPDATE {os.getenv('JOBS_TABLE')} SET lease_expires = NOW() + INTERVAL %s SECOND "
+                           f"WHERE lease_id = %s AND status = %s;", (self.job_lease_seconds, lease_id, "running"))
+                db.commit()
+            except sql.Error as e:
+                self.logger.warning(f"Failed to renew job lease {lease_id}: {e}")
+
+    def complete_job(self, job_id, lease_id):
+        """Mark a job as completed, as long as this worker still holds its lease."""
+        db = utils.db_connector()
+        db.execute(f"UPDATE {os.getenv('JOBS_TABLE')} SET status = %s, lease_expires = NULL "
+                   f"WHERE id = %s AND lease_id = %s;", ("completed", job_id, lease_id))
+        db.commit()
+        if db.cursor.rowcount == 0:
+            self.logger.warning(f"Lease on job {job_id} expired before it completed, another worker may rerun it")
+
+    def fail_job(self, job_id, lease_id, error: str, permanent: bool = False):
+        """
+        Record a failed attempt. The job goes back to the queue with an exponential backoff, or is marked dead once it
+        has used up JOB_MAX_ATTEMPTS (or straight away if retrying can't help).
+        """
+        db = utils.db_connector()
+        # MySQL applies SET assignments left to right, so everything that reads `attempts` comes before its increment
+        db.execute(f"UPDATE {os.getenv('JOBS_TABLE')} SET status = IF(%s OR attempts + 1 >= %s, %s, %s), "
+                   f"next_attempt_at = NOW() + INTERVAL LEAST(%s * POW(2, attempts), %s) SECOND, "
+                   f"attempts = attempts + 1, last_error = %s, worker_id = NULL, lease_id = NULL, lease_expires = NULL "
+                   f"WHERE id = %s AND lease_id = %s;",
+                   (permanent, self.job_max_attempts, "dead", "pending", self.job_retry_seconds,
+                    self.job_retry_max_seconds, utils.limit(error, 1000), job_id, lease_id))
+        db.commit()
+        db.execute(f"SELECT status, attempts, next_attempt_at FROM {os.getenv('JOBS_TABLE')} WHERE id = %s;",
+                   (job_id,))
+        job = db.fetchone()
+        if job and job[0] == "dead":
+            self.logger.error(f"Job {job_id} is dead after {job[1]} attempt(s): {error}")
+        elif job:
+            self.logger.warning(f"Job {job_id} failed (attempt {job[1]}/{self.job_max_attempts}), retrying at {job[2]}")
+
+    @tasks.loop()
+    async def deliver_notifications(self):
+        """Send queued webapp notifications as soon as they are enqueued, retrying failed ones when they are due."""
+        await utils.notifier.wait(int(os.getenv("WEBAPP_RETRY_INTERVAL", "30")))
+        try:
+            await utils.notifier.flush()
+        except sql.Error as e:
+            self.logger.error(f"Failed to read the notification outbox: {e}")
+
+    @tasks.loop(seconds=2)
+    async def write_behind(self):
+        """Flush the users and roles changed since the last run, see WRITE_BEHIND_INTERVAL."""
+        if len(self.writes):
+            try:
+                self.flush_writes()
+            except (sql.Error, sqlite3.Error) as e:
+                self.logger.error(f"Failed to flush buffered writes: {e}")
+
+    def flush_writes(self):
+        """
+        Write every buffered user and role to the cache store and the database, in batches of WRITE_BEHIND_BATCH_SIZE
+        that each use one transaction per store.
+
+        :return: The number of keys flushed
+        """
+        flushed = 0
+        while self.writes.roles:
+            rows = [(guild_id, role_id, self.cache[guild_id]["roles"][role_id])
+                    for guild_id, role_id in self.writes.take(self.writes.roles, self.write_batch_size)
+                    if role_id in self.cache.get(guild_id, {}).get("roles", {})]
+            self.store.put_roles(rows)
+            if self.role_table_sync:
+                for guild_id, role_id, _ in rows:
+                    self.sync_role_name_to_db(guild_id, role_id, commit=False)
+                utils.db_connector().commit()
+            flushed += len(rows)
+        while self.writes.users:
+            rows = [(guild_id, user_id, self.cache[guild_id]["users"][user_id])
+                    for guild_id, user_id in self.writes.take(self.writes.users, self.write_batch_size)
+                    if user_id in self.cache.get(guild_id, {}).get("users", {})]
+            self.store.put_users(rows)
+            if self.role_table_sync:
+                for guild_id, user_id, _ in rows:
+                    self.sync_user_roles_to_db(guild_id, user_id, commit=False)
+                utils.db_connector().commit()
+            flushed += len(rows)
+        if flushed:
+            self.writes.stats["flushed"] += flushed
+            self.writes.stats["flushes"] += 1
+            self.logger.debug(f"Flushed {flushed} buffered writes (totals: {self.writes.stats})")
+        return flushed
+
+    @tasks.loop(hours=6)
+    async def maintenance(self):
+        """Delete completed jobs and the ROLE_TABLE rows of members who are gone, once they pass their retention."""
+        await self.bot.wait_until_ready()
+        try:
+            await self.prune_jobs()
+            if self.role_table_sync:
+                await self.prune_role_rows()
+        except (sql.Error, OSError) as e:
+            self.logger.error(f"Maintenance failed: {e}")
+
+    def count_rows(self, table):
+        utils.db_connector().execute(f"SELECT COUNT(*) FROM `{table}`;")
+        return utils.db_connector().fetchone()[0]
+
+    def archive_rows(self, table, where, params):
+        """Append the rows matching `where` to today's archive for the table, if MAINTENANCE_ARCHIVE_DIR is set."""
+        if not self.archive_dir:
+            return
+        db = utils.db_connector()
+        db.execute(f"SELECT * FROM `{table}` WHERE {where};", params)
+        columns = [column[0] for column in db.cursor.description]
+        rows = [dict(zip(columns, row)) for row in db.fetchall()]
+        utils.append_archive(os.path.join(self.archive_dir, f"{table}-{datetime.now():%Y%m%d}.jsonl.gz"), rows)
+
+    async def prune_jobs(self):
+        """
+        Delete completed jobs older than JOB_RETENTION_DAYS, MAINTENANCE_BATCH_SIZE rows per transaction and for at most
+        MAINTENANCE_TIME_BUDGET seconds, whatever is left is picked up by the next run.
+        """
+        table = os.getenv('JOBS_TABLE')
+        db = utils.db_connector()
+        before = self.count_rows(table)
+        deleted = 0
+        deadline = time.monotonic() + self.maintenance_time_budget
+        while time.monotonic() < deadline:
+            # Uses idx_queue_age, so finding a batch never scans the table
+            db.execute(f"SELECT id FROM `{table}` WHERE process_id = %s AND status = %s "
+                       f"AND time_added < NOW() - INTERVAL %s DAY ORDER BY time_added LIMIT %s;",
+                       (utils.get_config("JOB_BOT_NAME"), "completed", self.job_retention_days,
+                        self.maintenance_batch_size))
+            ids = [row[0] for row in db.fetchall()]
+            if not ids:
+                break
+            where = f"id IN ({', '.join(['%s'] * len(ids))}) AND status = %s"
+            self.archive_rows(table, where, (*ids, "completed"))
+            db.execute(f"DELETE FROM `{table}` WHERE {where};", (*ids, "completed"))
+            deleted += db.cursor.rowcount
+            db.commit()
+            # Let the bot (and other database clients) get a word in between batches
+            await asyncio.sleep(0.1)
+        self.logger.info(f"Maintenance: {table} {before} -> {self.count_rows(table)} rows ({deleted} completed jobs "
+                         f"deleted)")
+
+    async def prune_role_rows(self):
+        """
+        Delete the ROLE_TABLE rows of members and guilds that are no longer in the cache and left more than
+        ROLE_RETENTION_DAYS ago, in the same batches as prune_jobs. Members who left while the bot was offline have no
+        LeftAt yet, they are stamped here and counted from now.
+        """
+        if not self.cache or self.is_cache_expired():
+            # An empty or stale cache would make every row look stale
+            return
+        if self.role_hashes is None:
+            self.load_role_hashes()
+        table = os.getenv('ROLE_TABLE')
+        db = utils.db_connector()
+        stale = [key for key in self.role_hashes
+                 if key[0] not in self.cache or key[1] not in self.cache[key[0]]["users"]]
+        before = self.count_rows(table)
+        deleted = 0
+        deadline = time.monotonic() + self.maintenance_time_budget
+        for start in range(0, len(stale), self.maintenance_batch_size):
+            if time.monotonic() >= deadline:
+                break
+            batch = stale[start:start + self.maintenance_batch_size]
+            keys = f"(guildID, userID) IN ({', '.join(['(%s, %s)'] * len(batch))})"
+            db.execute(f"UPDATE `{table}` SET LeftAt = NOW(), LastUpdate = LastUpdate "
+                       f"WHERE {keys} AND LeftAt IS NULL;", [value for key in batch for value in key])
+            db.commit()
+            where = f"{keys} AND LeftAt < NOW() - INTERVAL %s DAY"
+            params = (*[value for key in batch for value in key], self.role_retention_days)
+            db.execute(f"SELECT guildID, userID FROM `{table}` WHERE {where};", params)
+            expired = [(row[0], row[1]) for row in db.fetchall()]
+            if not expired:
+                continue
+            self.archive_rows(table, where, params)
+            db.execute(f"DELETE FROM `{table}` WHERE {where};", params)
+            deleted += db.cursor.rowcount
+            db.commit()
+            for key in expired:
+                self.role_hashes.pop(key, None)
+            await asyncio.sleep(0.1)
+        self.logger.info(f"Maintenance: {table} {before} -> {self.count_rows(table)} rows ({deleted} stale rows "
+                         f"deleted, {len(stale)} members no longer cached)")
 
     def role_convert(self, roleID: int):
         for guild in self.cache:
@@ -186,72 +1004,130 @@ class WebConnectorCog(commands.Cog):
     @tasks.loop(minutes=1)
     async def sync_cache(self):
         await self.bot.wait_until_ready()
-        await self.build_cache()
+        # The listeners keep the cache current, a full rebuild is only a safety net once it expires
+        if self.is_cache_expired():
+            await self.build_cache()
+        if not self.role_table_sync:
+            return
+        written, skipped = self.role_sync_stats["written"], self.role_sync_stats["skipped"]
         for cacheGuildID in self.cache:
+            for role in self.cache[cacheGuildID]["roles"]:
+                self.sync_role_name_to_db(cacheGuildID, role)
             for user in self.cache[cacheGuildID]["users"]:
-                t_roles = []
-                for role in self.cache[cacheGuildID]["users"][user]["roles"]:
-                    t_roles.append(self.role_convert(role))
-                if not t_roles:
-                    t_roles = []
-                utils.db_connector().execute(f"SELECT * FROM `{os.getenv('ROLE_TABLE')}` WHERE userID = %s AND guildID = %s;",
-                                             (user, cacheGuildID))
-                db_roles = utils.db_connector().fetchall()
-                if not db_roles:
-                    utils.db_connector().execute(f"INSERT INTO `{os.getenv('ROLE_TABLE')}` (userID, guildID, DiscordRoles, "
-                                                 f"LastUpdate) VALUES (%s, %s, %s, %s);",
-                                                 (user, cacheGuildID, utils.to_json(t_roles), datetime.now()))
-                    utils.db_connector().commit()
-                else:
-                    if db_roles[0][2] != t_roles:
-                        utils.db_connector().execute(f"UPDATE `{os.getenv('ROLE_TABLE')}` SET DiscordRoles = %s, LastUpdate "
-                                                     f"= %s WHERE userID = %s AND guildID = %s;",
-                                                     (utils.to_json(t_roles), datetime.now(), user, cacheGuildID))
-                        utils.db_connector().commit()
-        self.logger.info(f"Cache synced at {datetime.now()}")
+                self.sync_user_roles_to_db(cacheGuildID, user)
+        self.logger.info(f"Cache synced at {datetime.now()} ({self.role_sync_stats['written'] - written} rows "
+                         f"written, {self.role_sync_stats['skipped'] - skipped} unchanged, write-behind: "
+                         f"{self.writes.stats['flushed']} flushed, {self.writes.stats['coalesced']} coalesced)")
 
     @commands.Cog.listener()
     async def on_guild_role_create(self, role):
         guild_id = role.guild.id
         if guild_id not in self.cache:
-            await self.build_cache()
+            await self.cache_guild(role.guild)
         self.cache[guild_id]["roles"][role.id] = {"name": role.name}
         self.logger.info(f"Role created: {role.name} (ID: {role.id}) in guild {guild_id}. Cache updated.")
-        self.save_cache()
-        # Sync all users in this guild to DB since a new role may affect them
-        for user_id in self.cache[role.guild.id]["users"]:
-            self.sync_user_roles_to_db(role.guild.id, user_id)
+        # Nobody has a new role yet, so only its name needs storing
+        self.writes.mark_role(guild_id, role.id)
 
     @commands.Cog.listener()
     async def on_guild_role_update(self, before, after):
         guild_id = after.guild.id
         if guild_id not in self.cache:
-            await self.build_cache()
+            await self.cache_guild(after.guild)
         self.cache[guild_id]["roles"][after.id] = {"name": after.name}
         self.logger.info(f"Role updated: {before.name} -> {after.name} (ID: {after.id}) in guild {guild_id}. Cache updated.")
-        self.save_cache()
-        # Sync all users in this guild to DB since a role name may have changed
-        for user_id in self.cache[after.guild.id]["users"]:
-            self.sync_user_roles_to_db(after.guild.id, user_id)
-
-    def sync_user_roles_to_db(self, guild_id, user_id):
-        t_roles = []
-        for role in self.cache[guild_id]["users"][user_id]["roles"]:
-            t_roles.append(self.role_convert(role))
-        if not t_roles:
-            t_roles = []
-        utils.db_connector().execute(f"SELECT * FROM `{os.getenv('ROLE_TABLE')}` WHERE userID = %s AND guildID = %s;",
-                                     (user_id, guild_id))
-        db_roles = utils.db_connector().fetchall()
-        if not db_roles:
-            utils.db_connector().execute(f"INSERT INTO `{os.getenv('ROLE_TABLE')}` (userID, guildID, DiscordRoles, LastUpdate) VALUES (%s, %s, %s, %s);",
-                                         (user_id, guild_id, utils.to_json(t_roles), datetime.now()))
+        # ROLE_TABLE stores role IDs, so a rename is a single row in the role names table
+        self.writes.mark_role(guild_id, after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        guild_id = role.guild.id
+        if guild_id not in self.cache:
+            return
+        self.cache[guild_id]["roles"].pop(role.id, None)
+        self.forget_role_members(guild_id)
+        self.store.delete_role(guild_id, role.id)
+        if self.role_table_sync:
+            self.delete_role_name_from_db(role.id)
+        self.logger.info(f"Role deleted: {role.name} (ID: {role.id}) in guild {guild_id}. Cache updated.")
+        # Only the members that had the role need their row rewritten
+        for user_id, user in self.cache[guild_id]["users"].items():
+            if role.id in user["roles"]:
+                user["roles"].remove(role.id)
+                self.writes.mark_user(guild_id, user_id)
+
+    def load_role_names(self):
+        """Load the role names currently stored in the role names table."""
+        utils.db_connector().execute(f"SELECT roleID, name FROM `{utils.table('role_names')}`;")
+        self.role_names = {row[0]: row[1] for row in utils.db_connector().fetchall()}
+        self.logger.info(f"Loaded {len(self.role_names)} role names")
+
+    def sync_role_name_to_db(self, guild_id, role_id, commit: bool = True):
+        """
+        Write a role's name to the role names table, unless it is already stored.
+
+        :param commit: Commit straight away, pass False when the caller commits a batch of writes itself
+
+        :return: True if the row was written, False if it was skipped
+        """
+        if self.role_names is None:
+            self.load_role_names()
+        name = self.cache[guild_id]["roles"][role_id]["name"]
+        if self.role_names.get(role_id) == name:
+            return False
+        utils.db_connector().execute(f"INSERT INTO `{utils.table('role_names')}` (roleID, guildID, name) "
+                                     f"VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE name = VALUES(name);",
+                                     (role_id, guild_id, name))
+        if commit:
             utils.db_connector().commit()
+        self.role_names[role_id] = name
+        return True
+
+    def delete_role_name_from_db(self, role_id):
+        """Remove a deleted role from the role names table."""
+        utils.db_connector().execute(f"DELETE FROM `{utils.table('role_names')}` WHERE roleID = %s;", (role_id,))
+        utils.db_connector().commit()
+        if self.role_names is not None:
+            self.role_names.pop(role_id, None)
+
+    def load_role_hashes(self):
+        """
+        Load the stored role hash of every row in ROLE_TABLE. Rows from before hashing load as None, and rows that
+        still hold role names have a hash that no longer matches, so both are rewritten with role IDs on the next sync.
+        """
+        utils.db_connector().execute(f"SELECT guildID, userID, RolesHash FROM `{os.getenv('ROLE_TABLE')}`;")
+        self.role_hashes = {(row[0], row[1]): row[2] for row in utils.db_connector().fetchall()}
+        self.logger.info(f"Loaded {len(self.role_hashes)} role hashes")
+
+    def sync_user_roles_to_db(self, guild_id, user_id, commit: bool = True):
+        """
+        Write a user's role IDs to ROLE_TABLE, unless the stored hash shows the row is already up to date.
+
+        :param commit: Commit straight away, pass False when the caller commits a batch of writes itself
+
+        :return: True if the row was written, False if it was skipped
+        """
+        if self.role_hashes is None:
+            self.load_role_hashes()
+        roles_json = utils.to_json(sorted(self.cache[guild_id]["users"][user_id]["roles"]))
+        roles_hash = utils.content_hash(roles_json)
+        key = (guild_id, user_id)
+        if key in self.role_hashes and self.role_hashes[key] == roles_hash:
+            self.role_sync_stats["skipped"] += 1
+            return False
+        if key in self.role_hashes:
+            utils.db_connector().execute(f"UPDATE `{os.getenv('ROLE_TABLE')}` SET DiscordRoles = %s, LastUpdate = %s, "
+                                         f"RolesHash = %s WHERE userID = %s AND guildID = %s;",
+                                         (roles_json, datetime.now(), roles_hash, user_id, guild_id))
         else:
-            if db_roles[0][2] != t_roles:
-                utils.db_connector().execute(f"UPDATE `{os.getenv('ROLE_TABLE')}` SET DiscordRoles = %s, LastUpdate = %s WHERE userID = %s AND guildID = %s;",
-                                             (utils.to_json(t_roles), datetime.now(), user_id, guild_id))
-                utils.db_connector().commit()
+            utils.db_connector().execute(f"INSERT INTO `{os.getenv('ROLE_TABLE')}` (userID, guildID, DiscordRoles, "
+                                         f"LastUpdate, RolesHash) VALUES (%s, %s, %s, %s, %s);",
+                                         (user_id, guild_id, roles_json, datetime.now(), roles_hash))
+        if commit:
+            utils.db_connector().commit()
+        self.role_hashes[key] = roles_hash
+        self.role_sync_stats["written"] += 1
+        return True
 
     def get_cached_user(self, guild_id, discord_id=None, discord_username=None, discriminator=None):
         """
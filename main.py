@@ -132,6 +132,28 @@ def process_migration(mysql_files: str) -> list:
             out[i] = cmd
     return out
 
+def ensure_column(cursor, table: str, column: str, definition: str):
+    """
+    Add a column to an existing table if it is missing, CREATE TABLE IF NOT EXISTS won't do this for older tables.
+    """
+    cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                   "AND TABLE_NAME = %s AND COLUMN_NAME = %s;", (table, column))
+    if cursor.fetchone()[0] == 0:
+        logger.info(f"Adding column {column} to {table}")
+        cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN {column} {definition};")
+
+
+def ensure_index(cursor, table: str, index: str, columns: str):
+    """
+    Create an index on a table if it does not exist yet.
+    """
+    cursor.execute("SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() "
+                   "AND TABLE_NAME = %s AND INDEX_NAME = %s;", (table, index))
+    if cursor.fetchone()[0] == 0:
+        logger.info(f"Creating index {index} on {table}")
+        cursor.execute(f"CREATE INDEX {index} ON `{table}` ({columns});")
+
+
 @bot.event
 async def on_ready():
     logger.info(f"{bot.user} has connected to Discord ({len(bot.guilds)} guilds)!")
@@ -244,18 +266,71 @@ if __name__ == "__main__":
                   f"( guild_id BIGINT not null primary key, settings TEXT, thread_channels TEXT );")
         c.execute(f"CREATE TABLE IF NOT EXISTS `{os.getenv('THREADS_TABLE')}` "
                   f"(thread_id BIGINT PRIMARY KEY NOT NULL,channel_id BIGINT NOT NULL, note TEXT, note_id BIGINT, "
-                  f"note_last_update BIGINT, assigned_discord_ids TEXT);")
+                  f"note_last_update BIGINT, assigned_discord_ids TEXT, note_render_hash CHAR(64));")
+        ensure_column(c, os.getenv('THREADS_TABLE'), "note_render_hash", "CHAR(64)")
+        ensure_column(c, os.getenv('THREADS_TABLE'), "note_repost_at", "BIGINT")
+        ensure_column(c, os.getenv('THREADS_TABLE'), "pending_name", "TEXT")
+        ensure_column(c, os.getenv('THREADS_TABLE'), "pending_rename_at", "BIGINT")
+        ensure_column(c, os.getenv('THREADS_TABLE'), "rename_warning_id", "BIGINT")
         c.execute(f"CREATE TABLE IF NOT EXISTS `{os.getenv('ROLE_TABLE')}`(userID BIGINT not null,"
                   f"guildID BIGINT not null,"
                   f"DiscordRoles LONGTEXT  not null, "
-                  f"LastUpdate TIMESTAMP not null);")
+                  f"LastUpdate TIMESTAMP not null, "
+                  f"RolesHash CHAR(64));")
+        ensure_column(c, os.getenv('ROLE_TABLE'), "RolesHash", "CHAR(64)")
+        # When the member left the guild (or the bot did), ROLE_RETENTION_DAYS counts from here
+        ensure_column(c, os.getenv('ROLE_TABLE'), "LeftAt", "TIMESTAMP NULL")
+        ensure_index(c, os.getenv('ROLE_TABLE'), "idx_user_guild", "userID, guildID")
+        c.execute(f"CREATE TABLE IF NOT EXISTS `{utils.table('role_names')}` ("
+                  f"roleID BIGINT NOT NULL PRIMARY KEY, "
+                  f"guildID BIGINT NOT NULL, "
+                  f"name TEXT NOT NULL, "
+                  f"LastUpdate TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP);")
+        # DiscordRoles holds a JSON list of role IDs, the view turns it back into role names for the webapp. Members
+        # without roles get [] and role IDs without a name are left out, like the old list of names.
+        # JSON_TABLE needs MySQL 8.0.14+ or MariaDB 10.6+, older servers run without the view.
+        try:
+            c.execute(f"CREATE OR REPLACE VIEW `{utils.table('role_view')}` AS "
+                      f"SELECT r.userID, r.guildID, COALESCE(("
+                      f"SELECT JSON_ARRAYAGG(n.name) "
+                      f"FROM JSON_TABLE(r.DiscordRoles, '$[*]' COLUMNS (roleID BIGINT PATH '$')) ids "
+                      f"JOIN `{utils.table('role_names')}` n ON n.roleID = ids.roleID"
+                      f"), JSON_ARRAY()) AS DiscordRoles, r.LastUpdate "
+                      f"FROM `{os.getenv('ROLE_TABLE')}` r;")
+        except sql.Error as e:
+            logger.warning(f"Could not create {utils.table('role_view')}, it needs MySQL 8.0.14+ or MariaDB 10.6+: {e}")
         c.execute(f"CREATE TABLE IF NOT EXISTS `{os.getenv('JOBS_TABLE')}` ("
                   f"id BIGINT NOT NULL PRIMARY KEY AUTO_INCREMENT, "
                   f"process_id VARCHAR(255), "
                   f"payload LONGTEXT, "
                   f"status VARCHAR(10), "
                   f"priority INTEGER NOT NULL DEFAULT 0, "
-                  f"time_added TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);")
+                  f"time_added TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+                  f"worker_id VARCHAR(255), "
+                  f"lease_id CHAR(32), "
+                  f"lease_expires DATETIME NULL, "
+                  f"attempts INTEGER NOT NULL DEFAULT 0, "
+                  f"next_attempt_at DATETIME NULL, "
+                  f"last_error TEXT);")
+        ensure_column(c, os.getenv('JOBS_TABLE'), "worker_id", "VARCHAR(255)")
+        ensure_column(c, os.getenv('JOBS_TABLE'), "lease_id", "CHAR(32)")
+        ensure_column(c, os.getenv('JOBS_TABLE'), "lease_expires", "DATETIME NULL")
+        ensure_column(c, os.getenv('JOBS_TABLE'), "attempts", "INTEGER NOT NULL DEFAULT 0")
+        ensure_column(c, os.getenv('JOBS_TABLE'), "next_attempt_at", "DATETIME NULL")
+        ensure_column(c, os.getenv('JOBS_TABLE'), "last_error", "TEXT")
+        ensure_index(c, os.getenv('JOBS_TABLE'), "idx_lease", "lease_id")
+        ensure_index(c, os.getenv('JOBS_TABLE'), "idx_queue", "process_id, status, priority, time_added")
+        ensure_index(c, os.getenv('JOBS_TABLE'), "idx_queue_age", "process_id, status, time_added")
+        c.execute(f"CREATE TABLE IF NOT EXISTS `{utils.table('outbox')}` ("
+                  f"id BIGINT NOT NULL PRIMARY KEY AUTO_INCREMENT, "
+                  f"endpoint VARCHAR(255) NOT NULL, "
+                  f"payload LONGTEXT NOT NULL, "
+                  f"attempts INTEGER NOT NULL DEFAULT 0, "
+                  f"next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+                  f"last_error TEXT, "
+                  f"time_added TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+                  f"INDEX idx_due (next_attempt_at));")
+        ensure_index(c, utils.table('outbox'), "idx_endpoint", "endpoint, id")
         database.commit()
     database.close()
     logging.info("Starting bot")
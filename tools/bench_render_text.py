@@ -0,0 +1,122 @@
+"""
+Benchmark utils.render_text against the character-by-character renderer it replaced.
+
+Example:
+    python tools/bench_render_text.py --sizes 1000 10000 50000
+
+Both renderers run against a fake thread, and the database lookups are answered in memory, so only the
+rendering itself is measured. The outputs of both renderers are compared before timing.
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BYPASS_PERMISSIONS", "234248229426823168")
+import utils  # noqa: E402
+
+ASSIGNED = [141249603293937664, 234248229426823168]
+LAST_UPDATE = 1700000000.0
+
+
+class FakeDatabase:
+    """Answers the single query the new renderer makes."""
+
+    def execute(self, *args, **kwargs):
+        pass
+
+    def fetchone(self):
+        return LAST_UPDATE, utils.to_json(ASSIGNED)
+
+
+async def fake_get_note(thread, replace_tags=True):
+    return "", LAST_UPDATE, 0
+
+
+async def fake_get_thread_assigned_users(thread):
+    return list(ASSIGNED)
+
+
+async def legacy_render_text(text, thread):
+    """The renderer from before the template engine, kept here only to compare against."""
+    text_ar = list(text)
+    inside_code_block = False
+    TAGS = utils.TAGS
+    for i, char in enumerate(text_ar):
+        if char == utils.CODE_BLOCK_CHAR:
+            inside_code_block = not inside_code_block
+        if not inside_code_block:
+            if "".join(text_ar[i:i + len(TAGS[0])]) == TAGS[0]:  # Date opened
+                text_ar[i:i + len(TAGS[0])] = str(utils.to_discord_timestamp(thread.created_at.timestamp()))
+            elif "".join(text_ar[i:i + len(TAGS[1])]) == TAGS[1]:  # LAST_UPDATED
+                note = await utils.get_note(thread, False)
+                text_ar[i:i + len(TAGS[1])] = str(utils.to_discord_timestamp(note[1]))
+            elif "".join(text_ar[i:i + len(TAGS[2])]) == TAGS[2]:  # THREAD_NAME
+                text_ar[i:i + len(TAGS[2])] = thread.name
+            elif "".join(text_ar[i:i + len(TAGS[3])]) == TAGS[3]:  # THREAD_POSTER_MENTION
+                text_ar[i:i + len(TAGS[3])] = thread.owner.mention
+            elif "".join(text_ar[i:i + len(TAGS[4])]) == TAGS[4]:  # THREAD_POSTER_USERNAME
+                text_ar[i:i + len(TAGS[4])] = thread.owner.display_name
+            elif "".join(text_ar[i:i + len(TAGS[5])]) == TAGS[5]:  # EDIT_PERMISSIONS_LIST
+                assigned_users = await utils.get_all_allowed_users(thread)
+                assigned_users = [f"<@{user}>" for user in assigned_users] if assigned_users else [
+                    "No one can edit this note."]
+                text_ar[i:i + len(TAGS[5])] = ", ".join(assigned_users)
+            elif "".join(text_ar[i:i + len(TAGS[6])]) == TAGS[6]:  # ASSIGNED_LIST
+                assigned_users = await utils.get_thread_assigned_users(thread)
+                assigned_users = [f"<@{user}>" for user in assigned_users] if assigned_users else [
+                    "No one has been assigned."]
+                text_ar[i:i + len(TAGS[6])] = ", ".join(assigned_users)
+    return "".join(text_ar)
+
+
+def build_note(size):
+    """A note of roughly `size` characters with every tag used, some of them inside code blocks."""
+    block = ("Project **notes** opened <DATE_OPENED> by <THREAD_POSTER_MENTION> (<THREAD_POSTER_USERNAME>) in "
+             "<THREAD_NAME>, last updated <LAST_UPDATED>.\nEditors: <EDIT_PERMISSIONS_LIST>\n"
+             "Assigned: <ASSIGNED_LIST>\nUse `<THREAD_NAME>` to show the name. ")
+    return (block * (size // len(block) + 1))[:size]
+
+
+async def timed(renderer, text, thread, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await renderer(text, thread)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare the template engine with the legacy renderer")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    utils.SQLManager = FakeDatabase()
+    utils.get_note = fake_get_note
+    utils.get_thread_assigned_users = fake_get_thread_assigned_users
+    owner = types.SimpleNamespace(id=141249603293937664, mention="<@141249603293937664>", display_name="Owner")
+    thread = types.SimpleNamespace(id=1, name="Example thread", owner=owner,
+                                   created_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+
+    print(f"{'size':>8} {'legacy ms':>12} {'engine ms':>12} {'cached ms':>12} {'speedup':>9}")
+    for size in args.sizes:
+        text = build_note(size)
+        legacy_output = await legacy_render_text(text, thread)
+        utils.compile_template.cache_clear()
+        assert await utils.render_text(text, thread) == legacy_output, "renderers disagree"
+        legacy = await timed(legacy_render_text, text, thread, args.repeat)
+        utils.compile_template.cache_clear()
+        start = time.perf_counter()
+        await utils.render_text(text, thread)
+        cold = (time.perf_counter() - start) * 1000
+        cached = await timed(utils.render_text, text, thread, args.repeat)
+        print(f"{size:>8} {legacy:>12.2f} {cold:>12.2f} {cached:>12.2f} {legacy / cached:>8.0f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""
+Stand-in for the webapp when testing the bot's local job API.
+
+Examples:
+    python tools/job_client.py notify
+    python tools/job_client.py roles 141249603293937664 Member Builder
+    python tools/job_client.py roles --by-name someone Member
+    python tools/job_client.py bulk entries.json
+
+entries.json is a list of {"discord_id": ..., "roles": [...]} objects.
+
+Reads API_HOST, API_PORT and WEBAPP_KEY from the same .env file the bot uses.
+"""
+
+import argparse
+import json
+import os
+import dotenv
+import requests
+
+dotenv.load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push jobs to the bot's local API")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("notify", help="Tell the bot that new jobs are waiting in JOBS_TABLE")
+    roles = sub.add_parser("roles", help="Push an update-user-roles job")
+    roles.add_argument("user", help="The user's discord ID (or username with --by-name)")
+    roles.add_argument("roles", nargs="*", help="The full list of role names the user should end up with")
+    roles.add_argument("--by-name", action="store_true", help="Look the user up by username instead of ID")
+    roles.add_argument("--priority", type=int, default=0)
+    bulk = sub.add_parser("bulk", help="Push a bulk-update-user-roles job")
+    bulk.add_argument("file", help="JSON file with the list of entries")
+    bulk.add_argument("--priority", type=int, default=0)
+    args = parser.parse_args()
+
+    url = f"http://{os.getenv('API_HOST', '127.0.0.1')}:{os.getenv('API_PORT', '8765')}"
+    headers = {"SS-API-KEY": os.getenv("WEBAPP_KEY", "")}
+    if args.command == "notify":
+        response = requests.post(f"{url}/jobs/notify", headers=headers, timeout=5)
+    elif args.command == "bulk":
+        with open(args.file) as f:
+            job = {"endpoint": "bulk-update-user-roles", "data": {"entries": json.load(f)}, "priority": args.priority}
+        response = requests.post(f"{url}/jobs", json=job, headers=headers, timeout=5)
+    else:
+        data = {"new_roles": args.roles}
+        if args.by_name:
+            data["discord_username"] = args.user
+        else:
+            data["discord_id"] = int(args.user)
+        job = {"endpoint": "update-user-roles", "data": data, "priority": args.priority}
+        response = requests.post(f"{url}/jobs", json=job, headers=headers, timeout=5)
+    print(response.status_code, response.text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Stand-in for the webapp's notification endpoints, for testing the bot's outbox without touching the real site.
+
+Example:
+    python tools/webapp_stub.py --port 8080 --fail-rate 0.3
+    # then run the bot with WEBAPP_URL=http://127.0.0.1:8080/api/
+
+Every request is printed. With --fail-rate, that share of requests gets a 503 so the retry path can be watched.
+"""
+
+import argparse
+import os
+import random
+import dotenv
+from aiohttp import web
+
+dotenv.load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake webapp that accepts the bot's notifications")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests to answer with a 503")
+    args = parser.parse_args()
+    received = {"ok": 0, "failed": 0}
+
+    async def notification(request):
+        if request.headers.get("SS-API-KEY", "") != os.getenv("WEBAPP_KEY", ""):
+            print(f"401 {request.path}: bad SS-API-KEY")
+            return web.json_response({"error": "unauthorized"}, status=401)
+        body = await request.json()
+        if random.random() < args.fail_rate:
+            received["failed"] += 1
+            print(f"503 {request.path}: {body}")
+            return web.json_response({"error": "try again later"}, status=503)
+        received["ok"] += len(body["updates"]) if "updates" in body else 1
+        print(f"200 {request.path}: {body} (accepted {received['ok']}, refused {received['failed']})")
+        return web.json_response({"status": "ok"})
+
+    app = web.Application()
+    app.add_routes([web.post("/api/{endpoint}", notification)])
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
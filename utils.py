@@ -1,3 +1,9 @@
+import asyncio
+import bisect
+import contextlib
+import functools
+import gzip
+import hashlib
 import json
 import logging
 import os
@@ -5,6 +11,7 @@ import re
 from logging import exception
 from pprint import pprint
 import time
+import aiohttp
 import pymysql as sql
 import discord
 import datetime
@@ -19,13 +26,16 @@ dotenv.load_dotenv()
 DEFAULT_SETTINGS = {
     "defaultNote": {"default": os.getenv('DEFAULT_NOTE')},
     "discordTags": {},
-    "lastRename": {}
+    "lastRename": {},
+    "stickyNotes": {}
 }
 
 # Tags used in the notes
 TAGS = ["<DATE_OPENED>", "<LAST_UPDATED>", "<THREAD_NAME>", "<THREAD_POSTER_MENTION>", "<THREAD_POSTER_USERNAME>",
         "<EDIT_PERMISSIONS_LIST>", "<ASSIGNED_LIST>"]
 CODE_BLOCK_CHAR = "`"
+# Matches a code block character or any tag, so a note can be tokenized in a single pass
+TEMPLATE_TOKEN_REGEX = re.compile("|".join(re.escape(token) for token in [CODE_BLOCK_CHAR] + TAGS))
 
 HEX_REGEX = r"^(?:[0-9a-fA-F]{3}){1,2}$"
 
@@ -123,6 +133,178 @@ class SQLManager:
 SQLManager = SQLManager()
 
 
+class JobPool:
+    """
+    Limit how many jobs run at once, while making jobs that share a key (the member they change) run one at a time.
+    """
+
+    def __init__(self, limit: int):
+        """
+        Initialize the JobPool.
+
+        :param limit: The maximum number of jobs that may run at the same time
+        """
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.locks = {}
+        self.resume_at = 0.0
+
+    def pause(self, seconds: float):
+        """
+        Stop handing out slots for a while, used when discord tells us we are being rate limited.
+
+        :param seconds: How long to wait before starting new jobs
+        """
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    async def wait_if_paused(self):
+        """Sleep until a pause started by pause() is over."""
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @contextlib.asynccontextmanager
+    async def member_lock(self, key):
+        """
+        Hold the lock for a key (without taking a slot), used for work that is already running inside a slot.
+
+        :param key: The key to lock, None means no locking
+        """
+        if key is None:
+            yield
+            return
+        lock = self.locks.setdefault(key, [asyncio.Lock(), 0])
+        lock[1] += 1
+        try:
+            async with lock[0]:
+                yield
+        finally:
+            lock[1] -= 1
+            if lock[1] == 0:
+                del self.locks[key]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, key=None):
+        """
+        Wait for a free slot (and for the key's lock, if a key is given) and hold it for the duration of the block.
+
+        :param key: Jobs with the same key never run at the same time, None means the job can run alongside anything
+        """
+        # Wait for the member first, so a job queued behind another job for the same member doesn't hold a slot
+        async with self.member_lock(key):
+            async with self.semaphore:
+                await self.wait_if_paused()
+                yield
+
+
+class Pacer:
+    """
+    Space out requests, globally and per key (the channel a message lives in), so a burst of edits stays inside
+    discord's rate limit buckets instead of running into them.
+    """
+
+    def __init__(self, rate: float, key_interval: float = 0):
+        """
+        Initialize the Pacer.
+
+        :param rate: The maximum number of requests per second overall
+        :param key_interval: The minimum number of seconds between two requests for the same key
+        """
+        self.interval = 1 / rate
+        self.key_interval = key_interval
+        self.next_at = 0.0
+        self.next_key = {}
+
+    async def wait(self, key=None):
+        """
+        Wait until the next request may be sent.
+
+        :param key: The key the request belongs to, None to only apply the global pace
+        """
+        now = time.monotonic()
+        at = max(now, self.next_at, self.next_key.get(key, 0.0))
+        self.next_at = at + self.interval
+        if key is not None:
+            if len(self.next_key) > 1000:
+                self.next_key = {k: v for k, v in self.next_key.items() if v > now}
+            self.next_key[key] = at + self.key_interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+class MemberNameIndex:
+    """
+    Find a guild's members by the start of their username or display name without going through every member. The
+    names are kept sorted as (lowercase name, member ID) pairs, so a prefix search is a binary search.
+    """
+
+    def __init__(self, members=()):
+        """
+        Initialize the MemberNameIndex.
+
+        :param members: The members to index, bots are left out
+        """
+        self.names = {member.id: self.member_names(member) for member in members if not member.bot}
+        self.entries = sorted((name, member_id) for member_id, names in self.names.items() for name in names)
+
+    @staticmethod
+    def member_names(member: discord.Member):
+        """
+        Get the names a member can be searched by
+
+        :param member: The member
+        :return: The lowercase username and display name
+        """
+        return {name.casefold() for name in (member.name, member.display_name) if name}
+
+    def add(self, member: discord.Member):
+        """
+        Index a member, or update their names if they are already indexed
+
+        :param member: The member to index
+        """
+        if member.bot:
+            return
+        names = self.member_names(member)
+        if self.names.get(member.id) == names:
+            return
+        self.remove(member.id)
+        for name in names:
+            bisect.insort(self.entries, (name, member.id))
+        self.names[member.id] = names
+
+    def remove(self, member_id: int):
+        """
+        Remove a member from the index
+
+        :param member_id: The ID of the member
+        """
+        for name in self.names.pop(member_id, ()):
+            i = bisect.bisect_left(self.entries, (name, member_id))
+            if i < len(self.entries) and self.entries[i] == (name, member_id):
+                del self.entries[i]
+
+    def search(self, prefix: str, limit: int = 25):
+        """
+        Find the members whose username or display name starts with a prefix
+
+        :param prefix: The start of the name, not case sensitive
+        :param limit: The maximum number of members to return
+        :return: The IDs of the matching members, in name order
+        """
+        prefix = prefix.casefold()
+        found = []
+        i = bisect.bisect_left(self.entries, (prefix,))
+        while i < len(self.entries) and len(found) < limit and self.entries[i][0].startswith(prefix):
+            if self.entries[i][1] not in found:
+                found.append(self.entries[i][1])
+            i += 1
+        return found
+
+    def __len__(self):
+        return len(self.names)
+
+
 def convert_permission(permissions: str | dict) -> dict | str:
     """
     Convert a string of permissions to a dictionary of permissions with the key being the permission name and the value
@@ -238,7 +420,7 @@ async def get_note(thread: discord.Thread, replace_tags: bool = True):
     note = SQLManager.fetchone()
     if note:
         if replace_tags:
-            text = await render_text(note[0], thread)
+            text = await render_text(note[0], thread, last_update=note[1])
             return text, note[1], note[2]
         else:
             return note[0], note[1], note[2]
@@ -345,47 +527,86 @@ def limit(string: str, limit: int):
     return string
 
 
-async def render_text(text: str, thread: discord.Thread):
+@functools.lru_cache(maxsize=256)
+def compile_template(text: str):
+    """
+    Split a note into literal text and tags, tags inside code blocks are kept as literal text. The result is cached,
+    so a note is only tokenized again when it changes.
+
+    :param text: The note to compile
+    :return: A tuple of (is_tag, value) parts
+    """
+    parts = []
+    inside_code_block = False
+    last = 0
+    for match in TEMPLATE_TOKEN_REGEX.finditer(text):
+        if match.group() == CODE_BLOCK_CHAR:
+            inside_code_block = not inside_code_block
+        elif not inside_code_block:
+            if match.start() > last:
+                parts.append((False, text[last:match.start()]))
+            parts.append((True, match.group()))
+            last = match.end()
+    if last < len(text):
+        parts.append((False, text[last:]))
+    return tuple(parts)
+
+
+async def get_tag_values(thread: discord.Thread, tags: set, last_update: float = None):
+    """
+    Get the values of the given tags for a thread, with at most one database query for all of them
+
+    :param thread: The thread to get the values for
+    :param tags: The tags that are used
+    :param last_update: The note's last update time, if the caller already has it
+    :return: A dictionary of tag -> value
+    """
+    values = {}
+    assigned = []
+    if (TAGS[1] in tags and last_update is None) or TAGS[5] in tags or TAGS[6] in tags:
+        SQLManager.execute(f"SELECT note_last_update, assigned_discord_ids FROM {table('threads')} "
+                           f"WHERE thread_id = %s", (thread.id,))
+        row = SQLManager.fetchone() or (None, None)
+        if last_update is None:
+            last_update = row[0]
+        try:
+            assigned = json.loads(row[1])
+        except (TypeError, ValueError):
+            assigned = []
+    if TAGS[0] in tags:  # DATE_OPENED
+        values[TAGS[0]] = to_discord_timestamp(thread.created_at.timestamp())
+    if TAGS[1] in tags:  # LAST_UPDATED
+        values[TAGS[1]] = to_discord_timestamp(last_update) if last_update is not None else "an unknown time"
+    if TAGS[2] in tags:  # THREAD_NAME
+        values[TAGS[2]] = thread.name
+    if TAGS[3] in tags:  # THREAD_POSTER_MENTION
+        values[TAGS[3]] = thread.owner.mention
+    if TAGS[4] in tags:  # THREAD_POSTER_USERNAME
+        values[TAGS[4]] = thread.owner.display_name
+    if TAGS[5] in tags:  # EDIT_PERMISSIONS_LIST
+        allowed_users = await get_all_allowed_users(thread, assigned)
+        values[TAGS[5]] = ", ".join([f"<@{user}>" for user in allowed_users]) if allowed_users else \
+            "No one can edit this note."
+    if TAGS[6] in tags:  # ASSIGNED_LIST
+        values[TAGS[6]] = ", ".join([f"<@{user}>" for user in assigned]) if assigned else "No one has been assigned."
+    return values
+
+
+async def render_text(text: str, thread: discord.Thread, last_update: float = None):
     """
     Render text with database variables, tags should only be replaced when they are outside of code blocks.
 
     :param thread: The thread to render the text for
     :param text: The text to render
+    :param last_update: The note's last update time, saves looking it up if the caller already has it
     :return: The rendered text
     """
-    text_ar = list(text)
-    inside_code_block = False
-
-    ###################################
-    # If it ain't broke, don't fix it #
-    ###################################
-
-    for i, char in enumerate(text_ar):
-        if char == CODE_BLOCK_CHAR:
-            inside_code_block = not inside_code_block
-        if not inside_code_block:
-            if "".join(text_ar[i:i + len(TAGS[0])]) == TAGS[0]:  # Date opened
-                text_ar[i:i + len(TAGS[0])] = str(to_discord_timestamp(thread.created_at.timestamp()))
-            elif "".join(text_ar[i:i + len(TAGS[1])]) == TAGS[1]:  # LAST_UPDATED
-                note = await get_note(thread, False)
-                text_ar[i:i + len(TAGS[1])] = str(to_discord_timestamp(note[1]))
-            elif "".join(text_ar[i:i + len(TAGS[2])]) == TAGS[2]:  # THREAD_NAME
-                text_ar[i:i + len(TAGS[2])] = thread.name
-            elif "".join(text_ar[i:i + len(TAGS[3])]) == TAGS[3]:  # THREAD_POSTER_MENTION
-                text_ar[i:i + len(TAGS[3])] = thread.owner.mention
-            elif "".join(text_ar[i:i + len(TAGS[4])]) == TAGS[4]:  # THREAD_POSTER_USERNAME
-                text_ar[i:i + len(TAGS[4])] = thread.owner.display_name
-            elif "".join(text_ar[i:i + len(TAGS[5])]) == TAGS[5]:  # EDIT_PERMISSIONS_LIST
-                assigned_users = await get_all_allowed_users(thread)
-                assigned_users = [f"<@{user}>" for user in assigned_users] if assigned_users else [
-                    "No one can edit this note."]
-                text_ar[i:i + len(TAGS[5])] = ", ".join(assigned_users)
-            elif "".join(text_ar[i:i + len(TAGS[6])]) == TAGS[6]:  # ASSIGNED_LIST
-                assigned_users = await get_thread_assigned_users(thread)
-                assigned_users = [f"<@{user}>" for user in assigned_users] if assigned_users else [
-                    "No one has been assigned."]
-                text_ar[i:i + len(TAGS[6])] = ", ".join(assigned_users)
-    return "".join(text_ar)
+    parts = compile_template(text)
+    tags = {value for is_tag, value in parts if is_tag}
+    if not tags:
+        return text
+    values = await get_tag_values(thread, tags, last_update)
+    return "".join([values[value] if is_tag else value for is_tag, value in parts])
 
 
 def check_update(logger=None):
@@ -566,17 +787,19 @@ def paginator(items, embed_data, per_page=10, hard_limit=100, author: discord.Us
     return pages
 
 
-async def get_all_allowed_users(thread: discord.Thread):
+async def get_all_allowed_users(thread: discord.Thread, assigned: list = None):
     """
     Get all the users allowed to edit a thread's note
 
-    :param ctx: The context of the command
     :param thread: The thread to get the allowed users for
+    :param assigned: The users assigned to the thread, looked up if not given
     :return: The allowed users
     """
     allowed_users = [thread.owner.id]  # add the thread owner
     allowed_users += [int(user) for user in os.getenv("BYPASS_PERMISSIONS").split(",")]  # add all bypass permissions
-    allowed_users += await get_thread_assigned_users(thread)  # get all users assigned to the thread
+    if assigned is None:
+        assigned = await get_thread_assigned_users(thread)
+    allowed_users += assigned  # get all users assigned to the thread
     return list(dict.fromkeys(allowed_users))  # remove duplicates
 
 
@@ -640,7 +863,7 @@ async def safe_lock_thread(thread: discord.Thread, rename: bool = False):
                            (json.dumps(settings), thread.guild.id))
         SQLManager.commit()
     if rename:
-        await thread.edit(name=f"🔒 {thread.name} (Locked)", locked=True, archived=True)
+        await thread.edit(name=locked_name(thread.name), locked=True, archived=True)
         settings["lastRename"][str(thread.id)] = time_since_epoch()
         SQLManager.execute(f"UPDATE {table('guilds')} SET settings = %s WHERE guild_id = %s",
                            (json.dumps(settings), thread.guild.id))
@@ -672,7 +895,7 @@ async def safe_unlock_thread(thread: discord.Thread, rename: bool = False):
                            (json.dumps(settings), thread.guild.id))
         SQLManager.commit()
     if rename:
-        await thread.edit(name=thread.name.replace("🔒 ", "").replace(" (Locked)", ""), locked=False, archived=False)
+        await thread.edit(name=unlocked_name(thread.name), locked=False, archived=False)
         settings["lastRename"][str(thread.id)] = time_since_epoch()
         SQLManager.execute(f"UPDATE {table('guilds')} SET settings = %s WHERE guild_id = %s",
                            (json.dumps(settings), thread.guild.id))
@@ -683,6 +906,39 @@ async def safe_unlock_thread(thread: discord.Thread, rename: bool = False):
         return out
 
 
+def unlocked_name(name: str):
+    """
+    Get a thread's name without the lock decoration
+
+    :param name: The thread's current name
+    :return: The name without "🔒 " and " (Locked)"
+    """
+    return name.replace("🔒 ", "").replace(" (Locked)", "")
+
+
+def locked_name(name: str):
+    """
+    Get the name a thread gets when it is locked
+
+    :param name: The thread's current name
+    :return: The decorated name
+    """
+    return f"🔒 {unlocked_name(name)} (Locked)"
+
+
+async def record_rename(thread: discord.Thread):
+    """
+    Remember that a thread was just renamed, for the rename cooldown
+
+    :param thread: The renamed thread
+    """
+    settings = await get_settings(thread.guild)
+    settings["lastRename"][str(thread.id)] = time_since_epoch()
+    SQLManager.execute(f"UPDATE {table('guilds')} SET settings = %s WHERE guild_id = %s",
+                       (json.dumps(settings), thread.guild.id))
+    SQLManager.commit()
+
+
 async def can_rename(thread):
     """
     Check if a thread can be renamed based on the cooldown.
@@ -723,6 +979,12 @@ def table(t: str):
         return os.getenv("THREADS_TABLE") if os.getenv("THREADS_TABLE") else "threads"
     elif t == "embeds":
         return os.getenv("EMBEDS_TABLE") if os.getenv("EMBEDS_TABLE") else "embeds"
+    elif t == "outbox":
+        return os.getenv("OUTBOX_TABLE") if os.getenv("OUTBOX_TABLE") else "webhook_outbox"
+    elif t == "role_names":
+        return os.getenv("ROLE_NAMES_TABLE") if os.getenv("ROLE_NAMES_TABLE") else "discord_role_names"
+    elif t == "role_view":
+        return os.getenv("ROLE_VIEW") if os.getenv("ROLE_VIEW") else "discord_user_role_names"
     else:
         raise ValueError("Invalid type")
 
@@ -737,6 +999,21 @@ def to_json(data: dict | list):
     return json.dumps(data)
 
 
+def append_archive(path: str, rows: list):
+    """
+    Append rows to a gzip compressed JSON lines archive, creating it if needed
+
+    :param path: The archive file
+    :param rows: The rows to append, as dictionaries
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, default=str) + "\n")
+
+
 def from_json(data: str):
     """
     Convert a JSON string to a dictionary
@@ -747,6 +1024,18 @@ def from_json(data: str):
     return json.loads(data)
 
 
+def content_hash(data: str | dict | list):
+    """
+    Get a stable hash of some content, used to tell whether something needs to be written again
+
+    :param data: The string, or JSON serialisable object, to hash
+    :return: The hex digest of the content
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
 def convert_to_dict(cls: object):
     """
     Convert an object to a dictionary
@@ -788,152 +1077,457 @@ def sort_guilds(bot: discord.bot):
     return guilds
 
 
-async def process_job(job: dict, bot: discord.bot, logger, cache):
+def note_rate_limit(error: Exception, stats: dict = None):
+    """
+    Record a job's error in its stats, including whether discord rate limited it so the caller can slow down
+
+    :param error: The exception raised by discord
+    :param stats: The stats dictionary of the job
+    """
+    if stats is not None:
+        stats["error"] = repr(error)
+    if stats is not None and isinstance(error, discord.HTTPException) and error.status == 429:
+        try:
+            retry_after = float(error.response.headers.get("Retry-After", 1))
+        except (AttributeError, TypeError, ValueError):
+            retry_after = 1.0
+        stats["retry_after"] = max(stats.get("retry_after", 0), retry_after)
+
+
+async def apply_member_roles(member: discord.Member, new_roles: list, cache: dict, logger, reason: str,
+                             stats: dict = None):
+    """
+    Give a member exactly the named roles. The target role set is worked out once and applied with a single member
+    edit, per-role edits are only used when a role involved is above the bot's own role (or managed by discord).
+
+    :param member: The member to update
+    :param new_roles: The names of every role the member should end up with
+    :param cache: The WebConnector cache, used to look up role IDs by name
+    :param logger: The logger to use
+    :param reason: The audit log reason
+    :param stats: Optional dictionary to count REST calls ("rest_calls") and rate limits ("retry_after") into
+    :return tuple: (success, names of the roles added, names of the roles that could not be found)
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("rest_calls", 0)
+    guild = member.guild
+    cache_roles = cache.get(guild.id, {}).get("roles", {})
+    name_to_id = {v["name"]: k for k, v in cache_roles.items()}
+    # Filter out '@everyone' from new_roles
+    filtered_new_roles = [r for r in new_roles if r != "@everyone"]
+    current_roles = [role for role in member.roles if not role.is_default()]
+    current_role_names = set(role.name for role in current_roles)
+    # Roles to remove: currently assigned but not in new_roles
+    roles_to_remove = [role for role in current_roles if role.name not in filtered_new_roles]
+    # Roles to add: in new_roles but not currently assigned
+    roles_to_add = []
+    missing_roles = []
+    for role_name in dict.fromkeys(filtered_new_roles):
+        if role_name in current_role_names:
+            continue
+        role_id = name_to_id.get(role_name)
+        # Skip if role_id is the guild id (@everyone)
+        if role_id and role_id == guild.id:
+            logger.info(f"Skipping attempt to add @everyone role to {member.name} in {guild.name}.")
+            continue
+        if not role_id:
+            logger.warning(f"Role {role_name} not found in cache for {guild.name}")
+            missing_roles.append(role_name)
+            continue
+        role = guild.get_role(role_id)
+        if not role:
+            logger.warning(f"Role ID {role_id} not found in guild.roles for {role_name}")
+            missing_roles.append(role_name)
+            continue
+        roles_to_add.append(role)
+    if not roles_to_remove and not roles_to_add:
+        return True, [], missing_roles
+
+    if all(role.is_assignable() for role in roles_to_remove + roles_to_add):
+        target_roles = [role for role in current_roles if role not in roles_to_remove] + roles_to_add
+        try:
+            stats["rest_calls"] += 1
+            await member.edit(roles=target_roles, reason=reason)
+            logger.info(f"Updated roles of {member.name} in {guild.name}: removed "
+                        f"{[role.name for role in roles_to_remove]}, added {[role.name for role in roles_to_add]}")
+            return True, [role.name for role in roles_to_add], missing_roles
+        except discord.Forbidden as e:
+            logger.warning(f"Single edit of {member.name}'s roles was forbidden ({e}), falling back to per-role edits")
+        except Exception as e:
+            logger.error(f"Failed to update roles of {member.name}: {e}")
+            note_rate_limit(e, stats)
+            return False, [], missing_roles
+
+    # Fallback: at least one role is above the bot's own role, change the roles we can one at a time
+    for role in roles_to_remove:
+        if not role.is_assignable():
+            logger.warning(f"Role {role.name} is above the bot's role in {guild.name}, not removing it from "
+                           f"{member.name}.")
+            continue
+        try:
+            stats["rest_calls"] += 1
+            await member.remove_roles(role, reason=f"{reason} (remove old roles)")
+            logger.info(f"Removed role {role.name} from {member.name} in {guild.name}")
+        except discord.Forbidden as e:
+            if hasattr(e, 'code') and e.code == 50013:
+                logger.warning(f"Missing Permissions to remove role {role.name} from {member.name} in {guild.name}. "
+                               f"Skipping role removal.")
+                continue
+            logger.error(f"Failed to remove role {role.name} from {member.name}: {e}")
+            stats["error"] = repr(e)
+            return False, [], missing_roles
+        except Exception as e:
+            logger.error(f"Failed to remove role {role.name} from {member.name}: {e}")
+            note_rate_limit(e, stats)
+            return False, [], missing_roles
+    added_roles = []
+    for role in roles_to_add:
+        if not role.is_assignable():
+            logger.warning(f"Role {role.name} is above the bot's role in {guild.name}, not adding it to "
+                           f"{member.name}.")
+            continue
+        try:
+            stats["rest_calls"] += 1
+            await member.add_roles(role, reason=reason)
+            logger.info(f"Added role {role.name} to {member.name} in {guild.name}")
+            added_roles.append(role.name)
+        except discord.Forbidden as e:
+            if hasattr(e, 'code') and e.code == 50013:
+                logger.warning(f"Missing Permissions to add role {role.name} to {member.name} in {guild.name}. "
+                               f"Skipping this role.")
+                continue
+            logger.error(f"Failed to add role {role.name} to {member.name}: {e}")
+            stats["error"] = repr(e)
+            return False, added_roles, missing_roles
+        except Exception as e:
+            logger.error(f"Failed to add role {role.name} to {member.name}: {e}")
+            note_rate_limit(e, stats)
+            return False, added_roles, missing_roles
+    return True, added_roles, missing_roles
+
+
+def resolve_member(guilds: list, data: dict, name_index: dict = None):
+    """
+    Find the member a job refers to, by discord_id first, then by discord_username
+
+    :param guilds: The guilds to search, in order
+    :param data: The job data (or bulk job entry)
+    :param name_index: Optional index of {guild_id: {username: user_id}} so usernames don't need a scan of every member
+    :return: The member, or None if they could not be found
+    """
+    if "discord_id" in data:
+        discord_id = int(data["discord_id"])
+        for guild in guilds:
+            member = guild.get_member(discord_id)
+            if member:
+                return member
+    elif "discord_username" in data:
+        discord_username = data["discord_username"]
+        for guild in guilds:
+            if name_index is not None:
+                user_id = name_index.get(guild.id, {}).get(discord_username)
+                member = guild.get_member(user_id) if user_id else None
+            else:
+                member = guild.get_member_named(discord_username)
+            if member:
+                return member
+    return None
+
+
+async def process_job(job: dict, bot: discord.bot, logger, cache, stats: dict = None, pool: JobPool = None,
+                      name_index: dict = None):
     """
     Main subrutine for processing jobs
 
     :param job: The job to process
     :param bot: The bot to use
+    :param stats: Optional dictionary the job reports into: "latency_ms", "rest_calls", "retry_after" (when discord
+                  rate limited it), "error" (why it failed) and "permanent" (retrying will not help)
+    :param pool: The JobPool the job runs in, bulk jobs use it to lock each member they change
+    :param name_index: Optional index of {guild_id: {username: user_id}} used to find members by username
     :return bool: True if the job was processed successfully, False otherwise
     """
+    if stats is None:
+        stats = {}
+    stats["rest_calls"] = 0
+    started = time.monotonic()
     logger.debug(f"Start processing job: {job}")
     try:
         if job["endpoint"] == "update-user-roles":
             guilds = sort_guilds(bot)
             data = job.get("data", {})
-            user = None
-            member = None
-            # Prefer discord_id, fallback to discord_username
-            if "discord_id" in data:
-                discord_id = data["discord_id"]
-                for guild in guilds:
-                    member = guild.get_member(discord_id)
-                    if member:
-                        break
-                if not member:
-                    logger.warning(f"User with discord_id {discord_id} not found in any guild.")
-            elif "discord_username" in data:
-                discord_username = data["discord_username"]
-                for guild in guilds:
-                    member = guild.get_member_named(discord_username)
-                    if member:
-                        break
-                if not member:
-                    logger.warning(f"User with discord_username {discord_username} not found in any guild.")
-            else:
+            if "discord_id" not in data and "discord_username" not in data:
                 logger.error(f"Job missing required field 'discord_id' or 'discord_username': {job}")
+                stats["error"] = "Job missing required field 'discord_id' or 'discord_username'"
+                stats["permanent"] = True
                 return False
-            # If member was found, process roles
-            if member:
-                # Support both 'new_roles' and 'new_role' for compatibility
-                new_roles = data.get("new_roles") or data.get("new_role") or []
-                # Build a name->id map for fast lookup
-                guild_cache = cache.get(member.guild.id, {})
-                cache_roles = guild_cache.get("roles", {})
-                name_to_id = {v["name"]: k for k, v in cache_roles.items()}
-                # Filter out '@everyone' from new_roles
-                filtered_new_roles = [r for r in new_roles if r != "@everyone"]
-                # Get current role names (excluding @everyone)
-                current_roles = [role for role in member.roles if role.name != "@everyone"]
-                current_role_names = set(role.name for role in current_roles)
-                # Roles to remove: currently assigned but not in new_roles
-                roles_to_remove = [role for role in current_roles if role.name not in filtered_new_roles]
-                # Roles to add: in new_roles but not currently assigned, filter out '@everyone' again for safety
-                roles_to_add = [role_name for role_name in filtered_new_roles if role_name not in current_role_names and role_name != "@everyone"]
-                # Remove roles
-                if roles_to_remove:
-                    for role in roles_to_remove:
-                        try:
-                            await member.remove_roles(role, reason=f"j{job.get('job_id', 'unknown')} - update roles (remove old roles)")
-                            logger.info(f"Removed role {role.name} from {member.name} in {member.guild.name}")
-                        except discord.Forbidden as e:
-                            if hasattr(e, 'code') and e.code == 50013:
-                                logger.warning(f"Missing Permissions to remove role {role.name} from {member.name} in {member.guild.name}. Skipping role removal.")
-                                continue
-                            else:
-                                logger.error(f"Failed to remove role {role.name} from {member.name}: {e}")
-                                return False
-                        except Exception as e:
-                            logger.error(f"Failed to remove role {role.name} from {member.name}: {e}")
-                            return False
-                # Add new roles
-                added_roles = []
-                missing_roles = []
-                for role_name in roles_to_add:
-                    role_id = name_to_id.get(role_name)
-                    # Skip if role_name is '@everyone' or role_id is the guild id
-                    if role_name == "@everyone" or (role_id and str(role_id) == str(member.guild.id)):
-                        logger.info(f"Skipping attempt to add @everyone role to {member.name} in {member.guild.name}.")
-                        continue
-                    if role_id:
-                        role = discord.utils.get(member.guild.roles, id=role_id)
-                        if role:
-                            try:
-                                await member.add_roles(role, reason=f"j{job.get('job_id', 'unknown')} - update roles from job queue")
-                                logger.info(f"Added role {role.name} to {member.name} in {member.guild.name}")
-                                added_roles.append(role.name)
-                            except discord.Forbidden as e:
-                                if hasattr(e, 'code') and e.code == 50013:
-                                    logger.warning(f"Missing Permissions to add role {role.name} to {member.name} in {member.guild.name}. Skipping this role.")
-                                    continue
-                                else:
-                                    logger.error(f"Failed to add role {role.name} to {member.name}: {e}")
-                                    return False
-                            except Exception as e:
-                                logger.error(f"Failed to add role {role.name} to {member.name}: {e}")
-                                return False
-                        else:
-                            logger.warning(f"Role ID {role_id} not found in guild.roles for {role_name}")
-                            missing_roles.append(role_name)
-                    else:
-                        logger.warning(f"Role {role_name} not found in cache for {member.guild.name}")
-                        missing_roles.append(role_name)
-                # Notify webapp
-                notify_roles_updated(member.id, added_roles)
-                if not added_roles and missing_roles:
-                    logger.error(f"Job failed: The following roles were not found in cache or could not be added for {member.guild.name}: {missing_roles}")
-                    return False
-                return True
+            member = resolve_member(guilds, data, name_index)
+            if not member:
+                if "discord_id" in data:
+                    stats["error"] = f"User with discord_id {data['discord_id']} not found in any guild"
+                else:
+                    stats["error"] = f"User with discord_username {data['discord_username']} not found in any guild"
+                logger.warning(f"{stats['error']}.")
+                return False
+            # Support both 'new_roles' and 'new_role' for compatibility
+            new_roles = data.get("new_roles") or data.get("new_role") or []
+            success, added_roles, missing_roles = await apply_member_roles(
+                member, new_roles, cache, logger, f"j{job.get('job_id', 'unknown')} - update roles from job queue",
+                stats)
+            if not success:
+                return False
+            # Notify webapp
+            notify_roles_updated(member.id, added_roles)
+            if not added_roles and missing_roles:
+                logger.error(f"Job failed: The following roles were not found in cache or could not be added for {member.guild.name}: {missing_roles}")
+                stats["error"] = f"Roles not found in {member.guild.name}: {missing_roles}"
+                return False
+            return True
+        elif job["endpoint"] == "bulk-update-user-roles":
+            return await process_bulk_roles_job(job, bot, logger, cache, stats, pool, name_index)
+        else:
+            logger.error(f"Unknown job endpoint: {job.get('endpoint')}")
+            stats["error"] = f"Unknown job endpoint: {job.get('endpoint')}"
+            stats["permanent"] = True
+            return False
     except Exception as e:
         logger.error(f"Error processing job: {e}")
+        stats["error"] = repr(e)
+        if isinstance(e, (KeyError, TypeError, ValueError)):
+            # The payload itself is malformed
+            stats["permanent"] = True
         return False
     finally:
+        stats["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
         logger.debug(f"Finished processing job")
 
 
+async def process_bulk_roles_job(job: dict, bot: discord.bot, logger, cache, stats: dict, pool: JobPool = None,
+                                 name_index: dict = None):
+    """
+    Apply a bulk-update-user-roles job: {"entries": [{"discord_id": ..., "roles": [...]}, ...]}. Members whose cached
+    roles already match are skipped, the rest are edited concurrently and the webapp gets one notification at the end.
+
+    :return bool: True if every member that was found has the requested roles
+    """
+    entries = job.get("data", {}).get("entries")
+    if not isinstance(entries, list):
+        logger.error(f"Bulk job is missing its list of entries: {job}")
+        stats["error"] = "Bulk job is missing its list of entries"
+        stats["permanent"] = True
+        return False
+    guilds = sort_guilds(bot)
+    reason = f"j{job.get('job_id', 'unknown')} - bulk update roles from job queue"
+    counts = {"updated": 0, "unchanged": 0, "not_found": 0, "failed": 0}
+    results = []
+    name_to_id = {}
+    semaphore = asyncio.Semaphore(int(os.getenv("JOB_BULK_CONCURRENCY", "5")))
+
+    def matches_cache(member, new_roles):
+        """Check the requested roles against the cache, without touching discord."""
+        guild_cache = cache.get(member.guild.id, {})
+        cached_user = guild_cache.get("users", {}).get(member.id)
+        if cached_user is None:
+            return False
+        if member.guild.id not in name_to_id:
+            name_to_id[member.guild.id] = {v["name"]: k for k, v in guild_cache.get("roles", {}).items()}
+        wanted = {name_to_id[member.guild.id].get(name) for name in new_roles if name != "@everyone"}
+        return None not in wanted and wanted == set(cached_user["roles"]) - {member.guild.id}
+
+    async def apply_entry(entry):
+        if not isinstance(entry, dict):
+            counts["failed"] += 1
+            return
+        try:
+            member = resolve_member(guilds, entry, name_index)
+        except (TypeError, ValueError) as e:
+            # A discord_id that is null or not a number
+            logger.warning(f"Skipping malformed bulk job entry {entry!r}: {e!r}")
+            counts["failed"] += 1
+            stats["error"] = f"Malformed entry: {limit(repr(entry), 200)}"
+            return
+        if member is None:
+            counts["not_found"] += 1
+            return
+        new_roles = entry.get("roles") or entry.get("new_roles") or []
+        if matches_cache(member, new_roles):
+            counts["unchanged"] += 1
+            return
+        entry_stats = {}
+        async with pool.member_lock(str(member.id)) if pool else contextlib.nullcontext():
+            async with semaphore:
+                if pool:
+                    await pool.wait_if_paused()
+                success, added_roles, missing_roles = await apply_member_roles(member, new_roles, cache, logger,
+                                                                               reason, entry_stats)
+        stats["rest_calls"] += entry_stats.get("rest_calls", 0)
+        if "retry_after" in entry_stats:
+            stats["retry_after"] = max(stats.get("retry_after", 0), entry_stats["retry_after"])
+            if pool:
+                pool.pause(entry_stats["retry_after"])
+        if success:
+            counts["updated"] += 1
+            results.append({"discord_id": member.id, "new_roles": added_roles, "missing_roles": missing_roles})
+        else:
+            counts["failed"] += 1
+            stats["error"] = entry_stats.get("error", "Failed to update roles")
+
+    # An entry that raises must not leave the others running behind our back or skip the summary
+    for entry, result in zip(entries, await asyncio.gather(*[apply_entry(entry) for entry in entries],
+                                                           return_exceptions=True)):
+        if isinstance(result, Exception):
+            logger.error(f"Bulk job entry {entry!r} raised {result!r}")
+            counts["failed"] += 1
+            stats["error"] = repr(result)
+    logger.info(f"Bulk role job: {len(entries)} entries, {counts['updated']} updated, {counts['unchanged']} "
+                f"unchanged, {counts['not_found']} not found, {counts['failed']} failed")
+    stats["bulk"] = counts
+    # One notification for the whole job
+    notifier.enqueue("bulk-update-user-roles", {"results": results, **counts})
+    if counts["failed"]:
+        stats["error"] = f"{counts['failed']} of {len(entries)} entries failed, last error: {stats.get('error')}"
+        return False
+    return True
+
+
+class WebhookNotifier:
+    """
+    Sends notifications to the webapp without blocking the event loop. Every notification is written to the outbox
+    table first and only removed once the webapp has accepted it, failed sends are retried with exponential backoff.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.wake = asyncio.Event()
+        self.stats = {"sent": 0, "failed": 0}
+
+    def enqueue(self, endpoint: str, payload: dict):
+        """
+        Store a notification in the outbox and wake the sender
+
+        :param endpoint: The webapp endpoint, relative to WEBAPP_URL
+        :param payload: The JSON body to send
+        """
+        try:
+            SQLManager.execute(f"INSERT INTO {table('outbox')} (endpoint, payload) VALUES (%s, %s)",
+                               (endpoint, json.dumps(payload)))
+            SQLManager.commit()
+        except pymysql.err.Error as e:
+            logging.error(f"Failed to queue webapp notification ({endpoint}): {e}")
+            return
+        self.wake.set()
+
+    async def wait(self, timeout: float):
+        """
+        Wait until something is enqueued, or the timeout runs out
+
+        :param timeout: The longest time to wait, in seconds
+        """
+        try:
+            await asyncio.wait_for(self.wake.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wake.clear()
+
+    async def flush(self, max_rows: int = 100):
+        """
+        Send every notification in the outbox that is due, batching notifications for the same endpoint. An endpoint's
+        notifications are delivered in order, so none are sent while an older one for the same endpoint is still
+        waiting for its retry.
+
+        :param max_rows: The most notifications to send in one go
+        :return: The number of notifications delivered
+        """
+        SQLManager.execute(f"SELECT DISTINCT endpoint FROM {table('outbox')} WHERE next_attempt_at <= NOW()")
+        endpoints = [row[0] for row in SQLManager.fetchall()]
+        batch_size = max(1, int(os.getenv("WEBAPP_BATCH_SIZE", "1")))
+        delivered = 0
+        remaining = max_rows
+        for endpoint in endpoints:
+            if remaining <= 0:
+                break
+            SQLManager.execute(f"SELECT id, payload, next_attempt_at <= NOW() FROM {table('outbox')} "
+                               f"WHERE endpoint = %s ORDER BY id LIMIT %s", (endpoint, remaining))
+            endpoint_rows = []
+            for row in SQLManager.fetchall():
+                if not row[2]:
+                    # The oldest undelivered notification is backing off, everything after it waits too
+                    break
+                endpoint_rows.append(row)
+            remaining -= len(endpoint_rows)
+            for i in range(0, len(endpoint_rows), batch_size):
+                batch = endpoint_rows[i:i + batch_size]
+                ids = [row[0] for row in batch]
+                placeholders = ", ".join(["%s"] * len(ids))
+                error = await self.post(endpoint, [json.loads(row[1]) for row in batch])
+                if error is None:
+                    SQLManager.execute(f"DELETE FROM {table('outbox')} WHERE id IN ({placeholders})", ids)
+                    SQLManager.commit()
+                    self.stats["sent"] += len(batch)
+                    delivered += len(batch)
+                    continue
+                logging.error(f"Failed to notify webapp ({endpoint}, {len(batch)} notification(s)): {error}")
+                self.stats["failed"] += len(batch)
+                # attempts is read before the increment: 30s, 60s, 120s... capped at an hour
+                SQLManager.execute(f"UPDATE {table('outbox')} SET attempts = attempts + 1, last_error = %s, "
+                                   f"next_attempt_at = NOW() + INTERVAL LEAST(30 * POW(2, attempts), 3600) SECOND "
+                                   f"WHERE id IN ({placeholders})", [limit(error, 1000)] + ids)
+                SQLManager.commit()
+                # The failed batch is now the endpoint's oldest row that isn't due, which holds back the later ones
+                # until it is delivered
+                break
+        return delivered
+
+    async def post(self, endpoint: str, payloads: list):
+        """
+        POST a batch of notifications to the webapp. A single notification is sent as is, several are sent as
+        {"updates": [...]}.
+
+        :return: None on success, otherwise a description of the error
+        """
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        url = os.getenv("WEBAPP_URL", "https://shapestudio.net/api/")
+        url = url + endpoint if url.endswith("/") else f"{url}/{endpoint}"
+        body = payloads[0] if len(payloads) == 1 else {"updates": payloads}
+        headers = {"SS-API-KEY": os.getenv("WEBAPP_KEY", "")}
+        try:
+            async with self.session.post(url, json=body, headers=headers) as response:
+                response.raise_for_status()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return repr(e)
+        return None
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+# Notifications to the webapp go through this notifier, WebConnectorCog runs its delivery loop
+notifier = WebhookNotifier()
+
+
 def notify_username_changed(discord_id, old_username, new_username):
     """
     Notify the webapp that a username has changed.
     """
-    url = "https://shapestudio.net/api/username-changed"
-    payload = {
+    notifier.enqueue("username-changed", {
         "discord_id": discord_id,
         "old_username": old_username,
         "new_username": new_username
-    }
-    headers = {"SS-API-KEY": os.getenv("WEBAPP_KEY", "")}
-    try:
-        response = requests.post(url, json=payload, headers=headers, timeout=5)
-        response.raise_for_status()
-    except Exception as e:
-        logging.error(f"Failed to notify username change: {e}")
+    })
 
 
 def notify_roles_updated(discord_id, new_roles):
     """
     Notify the webapp that a user's roles have been updated.
     """
-    url = "https://shapestudio.net/api/update-user-roles"
-    payload = {
+    notifier.enqueue("update-user-roles", {
         "discord_id": discord_id,
         "new_roles": new_roles
-    }
-    headers = {"SS-API-KEY": os.getenv("WEBAPP_KEY", "")}
-    try:
-        response = requests.post(url, json=payload, headers=headers, timeout=5)
-        response.raise_for_status()
-    except Exception as e:
-        logging.error(f"Failed to notify roles update: {e}")
+    })
 
 
 def send_bot_channel_message(guild, message, bot):